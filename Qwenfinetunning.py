@@ -1,7 +1,6 @@
 import os
 import torch
 
-from datasets import load_dataset
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
@@ -13,6 +12,9 @@ from transformers import (
 from trl import SFTTrainer
 from peft import LoraConfig
 
+from fast_tokenizer import load_fast_tokenizer
+from model_store import load_local_dataset, model_path
+
 batch_size = 2
 num_workers = os.cpu_count()
 epochs = 10
@@ -23,8 +25,20 @@ context_length = 512
 learning_rate = 0.0001
 model_name = 'Qwen/Qwen1.5-0.5B'
 out_dir = 'outputs/qwen_05b_code'
-
-dataset = load_dataset('sahil2801/CodeAlpaca-20k')
+# Probe for the fastest micro-batch / accumulation split that keeps
+# batch_size * gradient_accumulation_steps fixed (see autotune.py)
+auto_tune_batch = False
+memory_budget_gb = None
+gradient_checkpointing = False
+# Memory-saving mode (see memsave.py): selectively checkpoint 'mlp',
+# 'attention' or whole 'layer' blocks, and keep AdamW state on the host
+checkpoint_policy = None
+offload_optimizer = False
+# Feed training batches through a shared-memory ring buffer with an
+# auto-sized worker pool instead of one forked worker per core
+shared_memory_loader = False
+
+dataset = load_local_dataset('sahil2801/CodeAlpaca-20k')
 print(dataset)
 
 full_dataset = dataset['train'].train_test_split(test_size=0.05, shuffle=True)
@@ -42,9 +56,9 @@ def preprocess_function(example):
     return text
 
 if bf16:
-    model = AutoModelForCausalLM.from_pretrained(model_name).to(dtype=torch.bfloat16)
+    model = AutoModelForCausalLM.from_pretrained(model_path(model_name)).to(dtype=torch.bfloat16)
 else:
-    model = AutoModelForCausalLM.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_path(model_name))
 
 print(model)
 # Total parameters and trainable parameters.
@@ -54,11 +68,33 @@ total_trainable_params = sum(
     p.numel() for p in model.parameters() if p.requires_grad)
 print(f"{total_trainable_params:,} training parameters.")
 
+if auto_tune_batch:
+    from autotune import auto_tune
+
+    if torch.cuda.is_available():
+        model = model.to('cuda')
+    tuned = auto_tune(
+        model,
+        model_name,
+        context_length,
+        effective_batch_size=batch_size * gradient_accumulation_steps,
+        memory_budget_gb=memory_budget_gb,
+    )
+    batch_size = tuned['per_device_train_batch_size']
+    gradient_accumulation_steps = tuned['gradient_accumulation_steps']
+    gradient_checkpointing = tuned['gradient_checkpointing']
+
+if checkpoint_policy is not None:
+    from memsave import apply_activation_checkpointing
+
+    apply_activation_checkpointing(model, checkpoint_policy)
 
-tokenizer = AutoTokenizer.from_pretrained(
-    model_name, 
+
+# Rust-backed tokenizer; check_parity() in fast_tokenizer.py verifies it
+# matches the slow one token-for-token on the training corpus
+tokenizer = load_fast_tokenizer(
+    model_path(model_name),
     trust_remote_code=True,
-    use_fast=False
 )
 
 print(tokenizer.pad_token)
@@ -80,6 +116,7 @@ training_args = TrainingArguments(
     report_to='tensorboard',
     dataloader_num_workers=num_workers,
     gradient_accumulation_steps=gradient_accumulation_steps,
+    gradient_checkpointing=gradient_checkpointing,
     learning_rate=learning_rate,
     lr_scheduler_type='constant',
 )
@@ -92,9 +129,20 @@ trainer = SFTTrainer(
     tokenizer=tokenizer,
     args=training_args,
     formatting_func=preprocess_function,
-    packing=True
+    packing=True,
 )
 
+if offload_optimizer:
+    from memsave import use_offload_optimizer
+
+    # Same decay / no-decay groups as the Trainer's default AdamW
+    use_offload_optimizer(trainer)
+
+if shared_memory_loader:
+    from shm_dataloader import use_shared_memory_loader
+
+    use_shared_memory_loader(trainer)
+
 
 dataloader = trainer.get_train_dataloader()
 for i, sample in enumerate(dataloader):
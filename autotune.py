@@ -0,0 +1,301 @@
+import json
+import os
+import platform
+import time
+
+import torch
+
+# Where tuned configurations are persisted, keyed by
+# (model, context_length, hardware fingerprint)
+cache_path = 'outputs/autotune_cache.json'
+warmup_steps = 1
+measure_steps = 3
+# AdamW keeps exp_avg and exp_avg_sq, each the size of the parameter
+optimizer_states_per_param = 2
+# On CPU without a budget, stop before a probe is predicted to use more
+# than this fraction of the host memory; the OOM killer gives no error
+host_memory_fraction = 0.8
+# Largest micro-batch probed on CPU when the host peak can't be measured
+cpu_max_micro_batch = 8
+
+
+def hardware_fingerprint():
+    """
+    Describe the accelerator the probes ran on.
+
+    Returns:
+        str: A stable string such as "cuda:NVIDIA A100-SXM4-40GB:40GB:x1"
+             or "cpu:x86_64:32".
+    """
+    if torch.cuda.is_available():
+        props = torch.cuda.get_device_properties(0)
+        total_gb = round(props.total_memory / 1024 / 1024 / 1024)
+        return f"cuda:{props.name}:{total_gb}GB:x{torch.cuda.device_count()}"
+    return f"cpu:{platform.machine()}:{os.cpu_count()}"
+
+
+def load_cache(path=cache_path):
+    """Load previously tuned configurations, or an empty dict."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_cache(cache, path=cache_path):
+    """Write tuned configurations back to disk."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _is_oom(error):
+    if isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    return 'out of memory' in str(error).lower()
+
+
+def _optimizer_state_gb(model):
+    """Device memory the AdamW moments will hold once training starts."""
+    state_bytes = sum(p.numel() * p.element_size() for p in model.parameters() if p.requires_grad)
+    return optimizer_states_per_param * state_bytes / 1024 / 1024 / 1024
+
+
+def _reset_host_peak():
+    """
+    Reset the process's resident-memory high-water mark (VmHWM).
+
+    ru_maxrss never goes down, so it can't give a per-probe peak; writing
+    5 to clear_refs (Linux 4.0+) restarts VmHWM from the current RSS.
+
+    Returns:
+        bool: False where this isn't supported.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _proc_gb(path, field):
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024 / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _current_memory_gb(device):
+    if device.type == 'cuda':
+        return torch.cuda.memory_allocated(device) / 1024 / 1024 / 1024
+    return _proc_gb('/proc/self/status', 'VmRSS')
+
+
+def _peak_memory_gb(model, device, host_peak_reset=False):
+    # The optimizer state isn't allocated during the probe, but stays
+    # resident for the whole run, so it is added on top
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 1024 / 1024 / 1024 + _optimizer_state_gb(model)
+    if not host_peak_reset:
+        return None
+    return _proc_gb('/proc/self/status', 'VmHWM') + _optimizer_state_gb(model)
+
+
+def _format_memory(peak_memory_gb):
+    return 'unknown' if peak_memory_gb is None else f"{peak_memory_gb:.2f} GB"
+
+
+def probe_micro_batch(model, micro_batch_size, context_length,
+                      gradient_checkpointing=False, steps=measure_steps):
+    """
+    Time forward + backward for one micro-batch size.
+
+    The optimizer step is left out on purpose: it runs once per
+    accumulation window regardless of the micro-batch size, so it does
+    not change which configuration is fastest, and running it would
+    update the weights about to be trained. Its AdamW state, which stays
+    resident for the whole run, is added to the measured peak instead.
+    On CPU the peak is the process's resident-memory high-water mark,
+    reset before the probe.
+
+    Args:
+        model: A causal LM already placed on its training device.
+        micro_batch_size (int): Sequences per forward pass.
+        context_length (int): Tokens per sequence.
+        gradient_checkpointing (bool): Recompute activations in backward.
+        steps (int): Timed steps after warmup.
+
+    Returns:
+        dict or None: {"step_time", "tokens_per_sec", "peak_memory_gb",
+                      "activation_gb"} (peak above the memory in use before
+                      the probe), or None if the micro-batch does not fit.
+                      Both memory figures are None on CPU when the host
+                      peak can't be reset.
+    """
+    device = next(model.parameters()).device
+    if gradient_checkpointing:
+        model.gradient_checkpointing_enable()
+    else:
+        model.gradient_checkpointing_disable()
+    model.config.use_cache = not gradient_checkpointing
+    model.train()
+
+    input_ids = torch.randint(
+        0, model.config.vocab_size, (micro_batch_size, context_length), device=device
+    )
+    host_peak_reset = False
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+    else:
+        host_peak_reset = _reset_host_peak()
+    baseline = _current_memory_gb(device)
+
+    try:
+        for step in range(warmup_steps + steps):
+            if step == warmup_steps:
+                if device.type == 'cuda':
+                    torch.cuda.synchronize(device)
+                start = time.perf_counter()
+            loss = model(input_ids=input_ids, labels=input_ids).loss
+            loss.backward()
+            model.zero_grad(set_to_none=True)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        step_time = (time.perf_counter() - start) / steps
+    except RuntimeError as e:
+        if not _is_oom(e):
+            raise
+        return None
+    finally:
+        model.zero_grad(set_to_none=True)
+        del input_ids
+        if device.type == 'cuda':
+            torch.cuda.empty_cache()
+
+    peak = _peak_memory_gb(model, device, host_peak_reset)
+    return {
+        'step_time': step_time,
+        'tokens_per_sec': micro_batch_size * context_length / step_time,
+        'peak_memory_gb': peak,
+        'activation_gb': None if peak is None else peak - _optimizer_state_gb(model) - baseline,
+    }
+
+
+def candidate_micro_batches(effective_batch_size):
+    """Micro-batch sizes that divide the effective batch size evenly, smallest first."""
+    return [b for b in range(1, effective_batch_size + 1) if effective_batch_size % b == 0]
+
+
+def auto_tune(model, model_name, context_length, effective_batch_size,
+              memory_budget_gb=None, try_checkpointing=True, path=cache_path,
+              force=False):
+    """
+    Pick the fastest (micro-batch, accumulation, checkpointing) split.
+
+    For each checkpointing setting, micro-batch sizes are probed in
+    increasing order until one runs out of memory or exceeds the budget,
+    or the next one is predicted to (activation memory grows linearly
+    with the micro-batch). On CPU, running out of memory means the OOM
+    killer rather than an exception, so without a budget the bound is
+    host_memory_fraction of the host's memory.
+    The effective batch size (micro-batch x accumulation steps) stays
+    fixed, so the optimization trajectory is unchanged. The winner is
+    cached per (model, context_length, hardware).
+
+    Args:
+        model: A causal LM already placed on its training device.
+        model_name (str): Name used in the cache key.
+        context_length (int): Tokens per sequence.
+        effective_batch_size (int): per_device_train_batch_size x
+            gradient_accumulation_steps to preserve.
+        memory_budget_gb (float): Peak memory ceiling; None means
+            "whatever fits" on GPU. On CPU it requires a resettable
+            host peak (Linux), otherwise ValueError is raised.
+        try_checkpointing (bool): Also probe with activation checkpointing.
+        path (str): JSON cache location.
+        force (bool): Ignore a cached result and re-probe.
+
+    Returns:
+        dict: per_device_train_batch_size, gradient_accumulation_steps,
+              gradient_checkpointing, tokens_per_sec, peak_memory_gb.
+    """
+    key = f"{model_name}|{context_length}|{effective_batch_size}|{hardware_fingerprint()}"
+    cache = load_cache(path)
+    if key in cache and not force:
+        print(f"[INFO] Using cached auto-tune result for {key}")
+        return cache[key]
+
+    candidates = candidate_micro_batches(effective_batch_size)
+    budget = memory_budget_gb
+    if next(model.parameters()).device.type != 'cuda':
+        if not _reset_host_peak():
+            if memory_budget_gb is not None:
+                raise ValueError("memory_budget_gb can't be enforced on CPU: the host memory peak can't be measured")
+            print(f"[INFO] Host memory peak can't be measured; probing micro-batches up to {cpu_max_micro_batch}")
+            candidates = [b for b in candidates if b <= cpu_max_micro_batch]
+        elif budget is None:
+            host_gb = _proc_gb('/proc/meminfo', 'MemAvailable') + _current_memory_gb(torch.device('cpu'))
+            budget = host_memory_fraction * host_gb
+
+    checkpointing_options = [False, True] if try_checkpointing else [False]
+    best = None
+    for gradient_checkpointing in checkpointing_options:
+        previous = None
+        for micro_batch_size in candidates:
+            if previous is not None and budget is not None:
+                size, peak, activation = previous
+                predicted = peak + max(activation, 0.0) * (micro_batch_size / size - 1)
+                if predicted > budget:
+                    print(f"[INFO] micro_batch={micro_batch_size} "
+                          f"checkpointing={gradient_checkpointing}: "
+                          f"predicted {predicted:.2f} GB over {budget:.2f} GB budget, not probed")
+                    break
+            result = probe_micro_batch(
+                model, micro_batch_size, context_length, gradient_checkpointing
+            )
+            if result is None:
+                print(f"[INFO] micro_batch={micro_batch_size} "
+                      f"checkpointing={gradient_checkpointing}: out of memory")
+                break
+            peak = result['peak_memory_gb']
+            if budget is not None and peak is not None and peak > budget:
+                print(f"[INFO] micro_batch={micro_batch_size} "
+                      f"checkpointing={gradient_checkpointing}: "
+                      f"{peak:.2f} GB over budget")
+                break
+            print(f"[INFO] micro_batch={micro_batch_size} "
+                  f"checkpointing={gradient_checkpointing}: "
+                  f"{result['tokens_per_sec']:,.0f} tokens/sec, "
+                  f"{_format_memory(peak)} peak")
+            if peak is not None:
+                previous = (micro_batch_size, peak, result['activation_gb'])
+            if best is None or result['tokens_per_sec'] > best['tokens_per_sec']:
+                best = {
+                    'per_device_train_batch_size': micro_batch_size,
+                    'gradient_accumulation_steps': effective_batch_size // micro_batch_size,
+                    'gradient_checkpointing': gradient_checkpointing,
+                    'tokens_per_sec': result['tokens_per_sec'],
+                    'peak_memory_gb': peak,
+                }
+
+    # Leave the model the way the training script expects it
+    model.gradient_checkpointing_disable()
+    model.config.use_cache = True
+
+    if best is None:
+        raise RuntimeError(
+            f"No micro-batch size fits for {model_name} at context_length={context_length}"
+        )
+
+    cache[key] = best
+    save_cache(cache, path)
+    print(f"[INFO] Auto-tune picked {best}")
+    return best
@@ -1,5 +1,4 @@
 import torch
-from datasets import load_dataset
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
@@ -8,8 +7,11 @@ from transformers import (
     BitsAndBytesConfig,
 )
 
+from model_store import load_local_dataset, model_path
+from verilog_constraint import VerilogConstraint, corpus_sample, load_masks
+
 # Step 1: Load Dataset
-data = load_dataset("bnadimi/PyraNet-Verilog")
+data = load_local_dataset("bnadimi/PyraNet-Verilog")
 
 # Split the dataset into train and validation sets
 data = data["train"].train_test_split(test_size=0.1)
@@ -18,12 +20,12 @@ eval_dataset = data["test"]
 
 # Step 2: Load Tokenizer and Model
 model_name = "codellama/CodeLlama-7B"  # Replace with the desired CodeLlama model variant
-tokenizer = AutoTokenizer.from_pretrained(model_name)
+tokenizer = AutoTokenizer.from_pretrained(model_path(model_name))
 
 # Load the model with quantization
 quantization_config = BitsAndBytesConfig(load_in_8bit=True)
 model = AutoModelForCausalLM.from_pretrained(
-    model_name,
+    model_path(model_name),
     device_map="auto",
     quantization_config=quantization_config,
     torch_dtype=torch.float16,
@@ -87,14 +89,25 @@ trainer.train()
 trainer.save_model("./codellama-pyranet-finetuned")
 tokenizer.save_pretrained("./codellama-pyranet-finetuned")
 
+# Compile the grammar masks along a sample of training modules (cached on disk)
+masks = load_masks(tokenizer, corpus=corpus_sample(train_dataset))
+
 # Step 8: Generate Code Function
-def generate_code(prompt, max_length=256):
-    """Generate code using the fine-tuned model."""
+def generate_code(prompt, max_length=256, constrained=False):
+    """
+    Generate code using the fine-tuned model.
+
+    With constrained=True the prompt is treated as the start of a module
+    (e.g. its header) and decoding is limited to a well-formed module,
+    stopping at its endmodule.
+    """
     model.eval()  # Set the model to evaluation mode
     inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    logits_processor = [VerilogConstraint(masks, prefix=prompt)] if constrained else []
     with torch.no_grad():
         outputs = model.generate(
             inputs.input_ids,
+            logits_processor=logits_processor,
             max_length=max_length,
             num_return_sequences=1,
             temperature=0.7,
@@ -107,6 +120,6 @@ def generate_code(prompt, max_length=256):
 # Example Usage
 if __name__ == "__main__":
     prompt = "module example (input a, input b, output c);"
-    generated_code = generate_code(prompt)
+    generated_code = generate_code(prompt, constrained=True)
     print("Generated Verilog Code:")
     print(generated_code)
\ No newline at end of file
@@ -25,7 +25,8 @@ from transformers import (
     DataCollatorForSeq2Seq,
     BitsAndBytesConfig,
 )
-from datasets import load_dataset
+from model_store import load_local_dataset, model_path
+from verilog_constraint import VerilogConstraint, corpus_sample, load_masks
 from peft import (
     LoraConfig,
     get_peft_model,
@@ -35,7 +36,7 @@ from peft import (
 )
 
 # Load dataset
-dataset = load_dataset("bnadimi/PyraNet-Verilog", split="train")
+dataset = load_local_dataset("bnadimi/PyraNet-Verilog", split="train")
 split_dataset = dataset.train_test_split(test_size=0.1)
 train_dataset = split_dataset["train"]
 eval_dataset = split_dataset["test"]
@@ -46,13 +47,13 @@ print(train_dataset[2])
 # Load model and tokenizer
 base_model = "codellama/CodeLlama-7b-hf"
 model = AutoModelForCausalLM.from_pretrained(
-    base_model,
+    model_path(base_model),
     trust_remote_code=True,
     load_in_8bit=True,
     torch_dtype=torch.float16,
     device_map="auto",
 )
-tokenizer = AutoTokenizer.from_pretrained(base_model)
+tokenizer = AutoTokenizer.from_pretrained(model_path(base_model))
 
 # Test model with an evaluation prompt
 eval_prompt = """You are a powerful text-to-verilog code generation model. Your job is to provide verilog code. You are given a description to generate the verilog code.
@@ -116,6 +117,10 @@ lora_config = LoraConfig(
 )
 model = get_peft_model(model, lora_config)
 
+# Fused LoRA forward: one in-place addmm per projection, shared q/k/v A matmul
+from lora_fused import fuse_lora_layers
+fuse_lora_layers(model)
+
 # Resume from checkpoint if specified
 resume_from_checkpoint = ""  # specify the checkpoint path if resuming
 if resume_from_checkpoint and os.path.exists(resume_from_checkpoint):
@@ -171,15 +176,18 @@ trainer = Trainer(
 
 # Train model
 trainer.train()
+# Write the final adapter to output_dir itself (checkpoints only go to
+# checkpoint-* subdirectories); it is reloaded below and by export_merged.py
+trainer.model.save_pretrained(output_dir)
 
 # Load final checkpoint
 model = AutoModelForCausalLM.from_pretrained(
-    base_model,
+    model_path(base_model),
     load_in_8bit=True,
     torch_dtype=torch.float16,
     device_map="auto",
 )
-tokenizer = AutoTokenizer.from_pretrained(base_model)
+tokenizer = AutoTokenizer.from_pretrained(model_path(base_model))
 model = PeftModel.from_pretrained(model, output_dir)
 
 # Test model post-training
@@ -187,4 +195,12 @@ model_input = tokenizer(eval_prompt, return_tensors="pt").to("cuda")
 model.eval()
 with torch.no_grad():
     generated = model.generate(**model_input, max_new_tokens=100)
+    print(tokenizer.decode(generated[0], skip_special_tokens=True))
+
+# Constrained to one well-formed module; stops at its endmodule
+masks = load_masks(tokenizer, corpus=corpus_sample(train_dataset))
+with torch.no_grad():
+    generated = model.generate(
+        **model_input, max_new_tokens=300, logits_processor=[VerilogConstraint(masks)]
+    )
     print(tokenizer.decode(generated[0], skip_special_tokens=True))
\ No newline at end of file
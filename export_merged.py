@@ -0,0 +1,182 @@
+import os
+import shutil
+import time
+
+import torch
+from peft import PeftModel
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    BitsAndBytesConfig,
+    GenerationConfig,
+)
+
+import model_store
+
+# Export configuration (matches codellm3.py)
+base_model = "codellama/CodeLlama-7b-hf"
+adapter_dir = "verilog-code-llama"
+out_dir = "outputs/merged_model"
+quantize = None  # None, "int8" or "nf4"
+max_shard_size = "2GB"
+dtype = torch.float16
+
+# Sampling defaults used by the serving scripts, baked into generation_config.json
+generation_defaults = dict(
+    max_new_tokens=512,
+    do_sample=True,
+    temperature=0.7,
+    top_k=50,
+    top_p=0.95,
+)
+
+
+def _quantization_config(quantize):
+    if quantize is None:
+        return None
+    if quantize == "int8":
+        return BitsAndBytesConfig(load_in_8bit=True)
+    if quantize == "nf4":
+        return BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_quant_type="nf4",
+            bnb_4bit_compute_dtype=dtype,
+        )
+    raise ValueError(f"Unknown quantization {quantize!r}, expected None, 'int8' or 'nf4'")
+
+
+def export_merged(base_model, adapter_dir, out_dir, quantize=None,
+                  max_shard_size=max_shard_size, dtype=dtype):
+    """
+    Merge a LoRA adapter into its base model and write one serving artifact.
+
+    The adapter is merged into full-precision base weights (merging into
+    an 8-bit base would compound quantization error), then optionally
+    re-quantized. The artifact holds sharded safetensors, the fast
+    tokenizer's tokenizer.json (so serving never converts from
+    sentencepiece) and a generation_config.json with the sampling
+    defaults.
+
+    Args:
+        base_model (str): Hub name or path of the base model.
+        adapter_dir (str): Directory written by PeftModel.save_pretrained.
+        out_dir (str): Where to write the merged artifact.
+        quantize (str): None, "int8" or "nf4".
+        max_shard_size (str): Largest safetensors shard.
+        dtype (torch.dtype): Precision of the merged weights.
+
+    Returns:
+        str: out_dir
+    """
+    print("[INFO] Loading base model and adapter...")
+    # The store copy the adapter was trained from (codellm3.py), if imported
+    base_model = model_store.model_path(base_model)
+    model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=dtype)
+    model = PeftModel.from_pretrained(model, adapter_dir)
+
+    print("[INFO] Merging adapter into base weights...")
+    model = model.merge_and_unload()
+
+    tokenizer = AutoTokenizer.from_pretrained(base_model, use_fast=True)
+    generation_config = GenerationConfig.from_model_config(model.config)
+    generation_config.update(**generation_defaults)
+    generation_config.eos_token_id = tokenizer.eos_token_id
+    generation_config.pad_token_id = (
+        tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    )
+    model.generation_config = generation_config
+
+    quantization_config = _quantization_config(quantize)
+    # Quantizing happens on load, so write the merged weights first
+    merged_dir = out_dir if quantization_config is None else f"{out_dir}.fp"
+    model.save_pretrained(merged_dir, safe_serialization=True, max_shard_size=max_shard_size)
+    del model
+
+    if quantization_config is not None:
+        print(f"[INFO] Quantizing merged weights ({quantize})...")
+        model = AutoModelForCausalLM.from_pretrained(
+            merged_dir,
+            quantization_config=quantization_config,
+            device_map="auto",
+        )
+        model.save_pretrained(out_dir, safe_serialization=True, max_shard_size=max_shard_size)
+        del model
+        shutil.rmtree(merged_dir)
+
+    tokenizer.save_pretrained(out_dir)
+    generation_config.save_pretrained(out_dir)
+    print(f"[INFO] Merged model written to {out_dir}")
+    return out_dir
+
+
+def load_for_inference(model_path):
+    """
+    Load a serving model and tokenizer from a Hub name, merged artifact or adapter.
+
+    A directory containing adapter_config.json is treated as an unmerged
+    LoRA adapter and stacked on its base model, which is what the merged
+    artifact avoids.
+
+    Returns:
+        tuple: (model, tokenizer)
+    """
+    adapter_config = os.path.join(model_path, "adapter_config.json")
+    if os.path.isfile(adapter_config):
+        from peft import PeftConfig
+
+        peft_config = PeftConfig.from_pretrained(model_path)
+        base_model = model_store.model_path(peft_config.base_model_name_or_path)
+        model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype="auto", device_map="auto")
+        model = PeftModel.from_pretrained(model, model_path)
+        tokenizer = AutoTokenizer.from_pretrained(base_model)
+    else:
+        model_path = model_store.model_path(model_path)
+        model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype="auto", device_map="auto")
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model.eval()
+    return model, tokenizer
+
+
+def measure_serving(model_path, prompt, new_tokens=128):
+    """
+    Time model load and greedy decoding of a fixed number of tokens.
+
+    Returns:
+        dict: {"load_time", "time_per_token"}
+    """
+    start = time.perf_counter()
+    model, tokenizer = load_for_inference(model_path)
+    load_time = time.perf_counter() - start
+
+    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
+    generate_kwargs = dict(
+        max_new_tokens=new_tokens, min_new_tokens=new_tokens, do_sample=False
+    )
+    with torch.no_grad():
+        model.generate(**inputs, max_new_tokens=4, do_sample=False)  # warmup
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        model.generate(**inputs, **generate_kwargs)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+    time_per_token = (time.perf_counter() - start) / new_tokens
+
+    del model
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    return {"load_time": load_time, "time_per_token": time_per_token}
+
+
+if __name__ == "__main__":
+    export_merged(base_model, adapter_dir, out_dir, quantize=quantize)
+
+    prompt = (
+        "Below is an instruction that describes a task. "
+        "Write a response that appropriately completes the request.\n\n"
+        "### Instruction:\nWrite a verilog module for a 4-bit adder.\n\n### Response:\n"
+    )
+    print(f"{'':>9} | {'load (s)':>9} | {'ms/token':>9}")
+    for label, path in (("unmerged", adapter_dir), ("merged", out_dir)):
+        stats = measure_serving(path, prompt)
+        print(f"{label:>9} | {stats['load_time']:9.2f} | {stats['time_per_token'] * 1000:9.2f}")
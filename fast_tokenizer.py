@@ -0,0 +1,196 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from transformers import AutoTokenizer
+
+batch_size = 1024
+num_threads = os.cpu_count()
+
+
+def load_fast_tokenizer(model_name, **kwargs):
+    """
+    Load the Rust-backed tokenizer, failing loudly if only a slow one exists.
+
+    Returns:
+        PreTrainedTokenizerFast
+    """
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True, **kwargs)
+    if not tokenizer.is_fast:
+        raise ValueError(f"{model_name} has no fast tokenizer")
+    return tokenizer
+
+
+def batch_encode(tokenizer, texts, batch_size=batch_size, num_threads=num_threads,
+                 add_special_tokens=True):
+    """
+    Encode many texts into token id lists.
+
+    Each batch goes through the Rust encode_batch, which releases the GIL,
+    so batches submitted from a thread pool tokenize in parallel instead
+    of queuing behind the interpreter lock.
+
+    Args:
+        tokenizer: A fast tokenizer.
+        texts (list of str): Texts to encode.
+        batch_size (int): Texts per encode_batch call.
+        num_threads (int): Batches in flight at once.
+        add_special_tokens (bool): As for tokenizer(...).
+
+    Returns:
+        list of list of int: Token ids, in input order.
+    """
+    backend = tokenizer.backend_tokenizer
+
+    def _encode(batch):
+        return [e.ids for e in backend.encode_batch(batch, add_special_tokens=add_special_tokens)]
+
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if num_threads is None or num_threads <= 1 or len(batches) <= 1:
+        results = map(_encode, batches)
+    else:
+        with ThreadPoolExecutor(max_workers=num_threads) as pool:
+            results = list(pool.map(_encode, batches))
+    return [ids for batch in results for ids in batch]
+
+
+def batch_decode(tokenizer, sequences, skip_special_tokens=True):
+    """Decode many token id lists with one Rust decode_batch call."""
+    return tokenizer.backend_tokenizer.decode_batch(
+        [list(ids) for ids in sequences], skip_special_tokens=skip_special_tokens
+    )
+
+
+def check_parity(slow_tokenizer, fast_tokenizer, texts, add_special_tokens=True, max_reports=10):
+    """
+    Verify the fast tokenizer produces exactly the slow tokenizer's ids.
+
+    Args:
+        slow_tokenizer: The use_fast=False tokenizer the scripts used before.
+        fast_tokenizer: Its fast counterpart.
+        texts (list of str): Corpus to compare on.
+        max_reports (int): Mismatches to describe in detail.
+
+    Returns:
+        list of dict: One entry per mismatching text (up to max_reports),
+                      with the index and the first differing position.
+    """
+    fast_ids = batch_encode(fast_tokenizer, texts, add_special_tokens=add_special_tokens)
+    mismatches = []
+    for i, (text, ids) in enumerate(zip(texts, fast_ids)):
+        slow_ids = slow_tokenizer(text, add_special_tokens=add_special_tokens)['input_ids']
+        if slow_ids == ids:
+            continue
+        position = next(
+            (j for j, (a, b) in enumerate(zip(slow_ids, ids)) if a != b),
+            min(len(slow_ids), len(ids)),
+        )
+        mismatches.append({
+            'index': i,
+            'position': position,
+            'slow': slow_ids[position:position + 5],
+            'fast': ids[position:position + 5],
+        })
+        if len(mismatches) >= max_reports:
+            break
+    return mismatches
+
+
+class IncrementalDetokenizer:
+    """
+    Turn a growing token sequence into text deltas for streaming.
+
+    Re-decoding the whole sequence after every token costs O(n) per step.
+    This only decodes a short window: the tokens since the last emitted
+    text, with the previously emitted tokens as left context, which
+    sentencepiece and byte-level BPE need to place leading spaces
+    correctly. Text ending in an incomplete UTF-8 sequence is held back
+    until it completes.
+    """
+
+    def __init__(self, tokenizer, skip_special_tokens=True):
+        self.tokenizer = tokenizer
+        self.skip_special_tokens = skip_special_tokens
+        self.ids = []
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    def _decode(self, ids):
+        return self.tokenizer.decode(ids, skip_special_tokens=self.skip_special_tokens)
+
+    def add(self, token_id):
+        """
+        Append one token.
+
+        Returns:
+            str: Newly completed text (may be empty).
+        """
+        self.ids.append(token_id)
+        prefix_text = self._decode(self.ids[self.prefix_offset:self.read_offset])
+        new_text = self._decode(self.ids[self.prefix_offset:])
+        if len(new_text) <= len(prefix_text) or new_text.endswith('\ufffd'):
+            return ''
+        delta = new_text[len(prefix_text):]
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(self.ids)
+        return delta
+
+    def add_many(self, token_ids):
+        """Append several tokens and return their combined text."""
+        return ''.join(self.add(t) for t in token_ids)
+
+
+def benchmark_encode(tokenizer, texts, **kwargs):
+    """Samples/sec for encoding texts with this tokenizer."""
+    start = time.perf_counter()
+    if tokenizer.is_fast:
+        batch_encode(tokenizer, texts, **kwargs)
+    else:
+        for text in texts:
+            tokenizer(text)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def benchmark_decode(tokenizer, ids):
+    """
+    Per-token cost of streaming decode: full re-decode vs IncrementalDetokenizer.
+
+    Returns:
+        dict: {"full_redecode", "incremental"} seconds per token.
+    """
+    start = time.perf_counter()
+    for i in range(1, len(ids) + 1):
+        tokenizer.decode(ids[:i], skip_special_tokens=True)
+    full = (time.perf_counter() - start) / len(ids)
+
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    start = time.perf_counter()
+    detokenizer.add_many(ids)
+    incremental = (time.perf_counter() - start) / len(ids)
+    return {'full_redecode': full, 'incremental': incremental}
+
+
+if __name__ == "__main__":
+    from model_store import load_local_dataset, model_path
+
+    model_name = model_path('Qwen/Qwen1.5-0.5B')
+    dataset = load_local_dataset('sahil2801/CodeAlpaca-20k', split='train')
+    # Same prompt layout as Qwenfinetunning.py's preprocess_function
+    texts = [
+        f"### Instruction:\n{e['instruction']}\n\n### Input:\n{e['input']}\n\n### Response:\n{e['output']}"
+        for e in dataset
+    ]
+
+    slow = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True, use_fast=False)
+    fast = load_fast_tokenizer(model_name, trust_remote_code=True)
+
+    mismatches = check_parity(slow, fast, texts)
+    print(f"[INFO] Parity on {len(texts)} samples: {'OK' if not mismatches else mismatches}")
+
+    print(f"slow: {benchmark_encode(slow, texts):10,.0f} samples/sec")
+    print(f"fast: {benchmark_encode(fast, texts):10,.0f} samples/sec")
+
+    ids = fast(texts[0] * 4)['input_ids'][:512]
+    decode = benchmark_decode(fast, ids)
+    print(f"decode, full re-decode: {decode['full_redecode'] * 1e6:8.1f} us/token")
+    print(f"decode, incremental:    {decode['incremental'] * 1e6:8.1f} us/token")
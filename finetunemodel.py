@@ -6,32 +6,38 @@ import gradio as gr
 from unsloth import FastLanguageModel
 from transformers import TextStreamer
 
+from model_store import model_path
+from metrics import MetricsStreamer, new_request_id, register_scheduler, serve_metrics, timed
+from scheduler import GenerationScheduler, gradio_handler
+
 # Load the model and tokenizer
 model_name = "Irfantariq01/lora_model"  # Replace with your fine-tuned model name
 max_seq_length = 512  # Adjust as needed
 
 print("[INFO] Loading model...")
-model, tokenizer = FastLanguageModel.from_pretrained(
-    model_name=model_name,
-    max_seq_length=max_seq_length,
-    dtype=None,
-    load_in_4bit=True,
-)
+with timed("model_load"):
+    model, tokenizer = FastLanguageModel.from_pretrained(
+        model_name=model_path(model_name),
+        max_seq_length=max_seq_length,
+        dtype=None,
+        load_in_4bit=True,
+    )
 
 # Enable faster inference
 FastLanguageModel.for_inference(model)
 print("[INFO] Model loaded and optimized for inference.")
 
 # Function to generate response
-def generate_code(description):
+def generate_code(description, max_new_tokens=512):
     """
     Generate Verilog or other code based on a description.
 
     Args:
         description (str): The natural language prompt for code generation.
+        max_new_tokens (int): Generation budget; the scheduler lowers it to fit the request deadline.
 
     Returns:
-        str: The generated code.
+        tuple: The generated code and the number of new tokens.
     """
     alpaca_prompt = (
         "Below is an instruction that describes a task. "
@@ -43,29 +49,39 @@ def generate_code(description):
     prompt = alpaca_prompt.format(description=description)
 
     # Tokenize and move inputs to GPU
-    inputs = tokenizer([prompt], return_tensors="pt").to("cuda")
+    request_id = new_request_id()
+    with timed("tokenize", request_id):
+        inputs = tokenizer([prompt], return_tensors="pt").to("cuda")
 
-    # Stream the response
-    text_streamer = TextStreamer(tokenizer)
+    # Stream the response; MetricsStreamer times prefill and each decode step
+    text_streamer = MetricsStreamer(TextStreamer(tokenizer), request_id)
     outputs = model.generate(
         **inputs,
         streamer=text_streamer,
-        max_new_tokens=512,
+        max_new_tokens=max_new_tokens,
     )
 
     # Decode the generated output
-    generated_code = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    return generated_code
+    with timed("detokenize", request_id):
+        generated_code = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    return generated_code, outputs.shape[1] - inputs["input_ids"].shape[1]
+
+# Bounded, fair, deadline-aware queue in front of the single GPU
+scheduler = GenerationScheduler(generate_code)
+register_scheduler(scheduler)
 
 # Define the Gradio Interface
 iface = gr.Interface(
-    fn=generate_code,
+    fn=gradio_handler(scheduler),
     inputs=gr.Textbox(lines=5, placeholder="Enter your description here..."),
     outputs=gr.Code(label="Generated Code"),  # Outputs as formatted code
     title="Code Generation with Small language model",
+    # Let every request reach the scheduler, which does its own admission control
+    concurrency_limit=None,
     description="Enter a description to generate Verilog or other code.",
 )
 
 # Launch the Gradio interface
 if __name__ == "__main__":
+    serve_metrics()
     iface.launch()
@@ -1,6 +1,5 @@
 import os
 import torch
-from datasets import load_dataset
 from transformers import (
 
     AutoModelForCausalLM,
@@ -12,6 +11,10 @@ from transformers import (
 )
 from trl import SFTTrainer
 from peft import LoraConfig
+
+from fast_tokenizer import load_fast_tokenizer
+from model_store import load_local_dataset, model_path
+
 device = torch.device("mps")
 dtype = torch.float32  # or torch.float16 for reduced precision
 tensor = torch.randn((10, 10), device=device, dtype=dtype)
@@ -25,7 +28,7 @@ context_length = 512
 learning_rate = 0.0001
 model_name = 'Qwen/Qwen1.5-0.5B'
 out_dir = 'outputs/qwen_05b_code'
-dataset = load_dataset('Irfantariq01/RTL')
+dataset = load_local_dataset('Irfantariq01/RTL')
 full_dataset = dataset['train'].train_test_split(test_size=0.05, shuffle=True)
 dataset_train = full_dataset['train']
 dataset_valid = full_dataset['test']
@@ -41,9 +44,9 @@ def preprocess_function(example):
     return text
 
 if bf16:
-    model = AutoModelForCausalLM.from_pretrained(model_name).to(dtype=torch.bfloat16)
+    model = AutoModelForCausalLM.from_pretrained(model_path(model_name)).to(dtype=torch.bfloat16)
 else:
-    model = AutoModelForCausalLM.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_path(model_name))
 print(model)
 # Total parameters and trainable parameters.
 
@@ -52,10 +55,11 @@ total_params = sum(p.numel() for p in model.parameters())
 print(f"{total_params:,} total parameters.")
 total_trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
 print(f"{total_trainable_params:,} training parameters.")
-tokenizer = AutoTokenizer.from_pretrained(
-    model_name, 
+# Rust-backed tokenizer; check_parity() in fast_tokenizer.py verifies it
+# matches the slow one token-for-token on the training corpus
+tokenizer = load_fast_tokenizer(
+    model_path(model_name),
     trust_remote_code=True,
-    use_fast=False
 ) 
 training_args = TrainingArguments(
     output_dir=f"{out_dir}/logs",
@@ -2,11 +2,12 @@ from unsloth import FastLanguageModel
 import torch
 import os
 from transformers import TextStreamer
-from datasets import load_dataset
 from trl import SFTTrainer
 from transformers import TrainingArguments
 from unsloth import is_bfloat16_supported
 
+from model_store import load_local_dataset, model_path
+
 # 1. Configuration
 max_seq_length = 2048
 dtype = None
@@ -24,7 +25,7 @@ huggingface_model_name = "mervinpraison/Llama-3.1-8B-bnb-4bit-python"
 
 # 2. Before Training
 model, tokenizer = FastLanguageModel.from_pretrained(
-    model_name = "unsloth/Meta-Llama-3.1-8B-bnb-4bit",
+    model_name = model_path("unsloth/Meta-Llama-3.1-8B-bnb-4bit"),
     max_seq_length = max_seq_length,
     dtype = dtype,
     load_in_4bit = load_in_4bit,
@@ -57,7 +58,7 @@ def formatting_prompts_func(examples):
         texts.append(text)
     return { "text" : texts, }
 pass
-dataset = load_dataset("iamtarun/python_code_instructions_18k_alpaca", split = "train")
+dataset = load_local_dataset("iamtarun/python_code_instructions_18k_alpaca", split = "train")
 dataset = dataset.map(formatting_prompts_func, batched = True,)
 
 # 4. Training
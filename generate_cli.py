@@ -1,14 +1,22 @@
 import argparse
+import os
 from transformers import AutoModelForCausalLM, AutoTokenizer
 
+from model_store import model_path
+
 # Load the model and tokenizer
 model_name = "Irfantariq01/lora_model"  # Replace with your fine-tuned model name
 max_seq_length = 512  # Adjust as needed
 
+# Serve the merged artifact written by export_merged.py when it exists
+merged_model_dir = "outputs/merged_model"
+if os.path.isdir(merged_model_dir):
+    model_name = merged_model_dir
+
 print("[INFO] Loading model...")
-tokenizer = AutoTokenizer.from_pretrained(model_name)
+tokenizer = AutoTokenizer.from_pretrained(model_path(model_name))
 model = AutoModelForCausalLM.from_pretrained(
-    model_name,
+    model_path(model_name),
     torch_dtype="auto",  # Automatically choose precision
     device_map="auto",   # Load model on GPU if available
 )
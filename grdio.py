@@ -1,28 +1,41 @@
+import os
+
 import gradio as gr
 from transformers import AutoModelForCausalLM, AutoTokenizer, TextStreamer
 
+from metrics import MetricsStreamer, new_request_id, register_scheduler, serve_metrics, timed
+from model_store import model_path
+from scheduler import GenerationScheduler, gradio_handler
+
 # Load the model and tokenizer for the pre-trained CodeLlama model
 model_name = "facebook/codellama-7b"  # Replace with your desired CodeLlama model
 max_seq_length = 512  # Adjust the sequence length if needed
 
+# Serve the merged artifact written by export_merged.py when it exists
+merged_model_dir = "outputs/merged_model"
+if os.path.isdir(merged_model_dir):
+    model_name = merged_model_dir
+
 print("[INFO] Loading model...")
 # Load the pre-trained model and tokenizer
-model = AutoModelForCausalLM.from_pretrained(model_name, device_map="auto", torch_dtype="auto")
-tokenizer = AutoTokenizer.from_pretrained(model_name)
+with timed("model_load"):
+    model = AutoModelForCausalLM.from_pretrained(model_path(model_name), device_map="auto", torch_dtype="auto")
+    tokenizer = AutoTokenizer.from_pretrained(model_path(model_name))
 
 # Enable faster inference
 print("[INFO] Model loaded and ready for inference.")
 
 # Function to generate code
-def generate_code(description):
+def generate_code(description, max_new_tokens=512):
     """
     Generate code based on a natural language description using the pre-trained CodeLlama model.
 
     Args:
         description (str): The natural language prompt for code generation.
+        max_new_tokens (int): Generation budget; the scheduler lowers it to fit the request deadline.
 
     Returns:
-        str: The generated code.
+        tuple: The generated code and the number of new tokens.
     """
     alpaca_prompt = (
         "Below is an instruction that describes a task. "
@@ -34,30 +47,40 @@ def generate_code(description):
     prompt = alpaca_prompt.format(description=description)
 
     # Tokenize the prompt and move inputs to GPU (if available)
-    inputs = tokenizer([prompt], return_tensors="pt").to("cuda")
+    request_id = new_request_id()
+    with timed("tokenize", request_id):
+        inputs = tokenizer([prompt], return_tensors="pt").to("cuda")
 
-    # Stream the response
-    text_streamer = TextStreamer(tokenizer)
+    # Stream the response; MetricsStreamer times prefill and each decode step
+    text_streamer = MetricsStreamer(TextStreamer(tokenizer), request_id)
     outputs = model.generate(
         **inputs,
         streamer=text_streamer,
-        max_new_tokens=512,
+        max_new_tokens=max_new_tokens,
     )
 
     # Decode the generated output
-    generated_code = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    return generated_code
+    with timed("detokenize", request_id):
+        generated_code = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    return generated_code, outputs.shape[1] - inputs["input_ids"].shape[1]
+
+# Bounded, fair, deadline-aware queue in front of the single GPU
+scheduler = GenerationScheduler(generate_code)
+register_scheduler(scheduler)
 
 # Define the Gradio Interface
 iface = gr.Interface(
-    fn=generate_code,
+    fn=gradio_handler(scheduler),
     inputs=gr.Textbox(lines=5, placeholder="Enter your description here..."),
     outputs=gr.Code(label="Generated Code"),  # Outputs as formatted code
     title="Code Generation with CodeLlama",
+    # Let every request reach the scheduler, which does its own admission control
+    concurrency_limit=None,
     description="Enter a description to generate code using the pre-trained CodeLlama model.",
 )
 
 # Launch the Gradio interface
 if __name__ == "__main__":
+    serve_metrics()
     iface.launch()
 
@@ -14,7 +14,7 @@ proc calculate_harmful_skew {} {
     set fh [open $report_file w]
     puts $fh "Harmful Skew Analysis Report - [clock format [clock seconds]]"
     puts $fh "----------------------------------------"
-    puts $fh "Path | Skew (ns) | Slack (ns) | Violation Type | Harmful Skew (ns)"
+    puts $fh "Path | Skew (ns) | Slack (ns) | Violation Type | Harmful Skew (ns) | Clock"
 
     # Output header to console
     puts "Harmful Skew Analysis Report"
@@ -76,10 +76,11 @@ proc calculate_harmful_skew {} {
     set median_harmful 0.0
     if {$num_harmful > 0} {
         set avg_harmful [expr {$total_harmful_skew / $num_harmful}]
+        # Sort once; min, max and median all come from the sorted list
         set sorted_harmful [lsort -real $harmful_skew_values]
         set median_harmful [median $sorted_harmful]
-        set max_harmful_skew [lindex [lsort -real -decreasing $harmful_skew_values] 0]
-        set min_harmful_skew [lindex [lsort -real $harmful_skew_values] 0]
+        set max_harmful_skew [lindex $sorted_harmful end]
+        set min_harmful_skew [lindex $sorted_harmful 0]
     }
 
     # Summary
@@ -180,6 +181,7 @@ proc process_path {path fh violation_type slack_list_var harmful_skew_values_var
         puts $fh "Warning: Invalid path endpoints"
         return 0
     }
+    set path_name "[get_attribute $startpoint full_name] -> [get_attribute $endpoint full_name]"
 
     # Get clock information
     set launch_clock [get_attribute $path startpoint_clock]
@@ -193,12 +195,11 @@ proc process_path {path fh violation_type slack_list_var harmful_skew_values_var
     set launch_clock_name [get_attribute $launch_clock name]
     set capture_clock_name [get_attribute $capture_clock name]
     if {$launch_clock_name ne $capture_clock_name} {
-        set path_name "[get_attribute $startpoint full_name] -> [get_attribute $endpoint full_name]"
         puts $fh "Warning: Cross-clock path ($launch_clock_name -> $capture_clock_name)"
         puts [format "%-80s | %8s | %8.3f | %-6s | %8s" \
               $path_name "N/A" $slack $violation_type "N/A"]
-        puts $fh [format "%-80s | %8s | %8.3f | %-6s | %8s" \
-                  $path_name "N/A" $slack $violation_type "N/A"]
+        puts $fh [format "%-80s | %8s | %8.3f | %-6s | %8s | %s" \
+                  $path_name "N/A" $slack $violation_type "N/A" "$launch_clock_name->$capture_clock_name"]
         return 0
     }
 
@@ -234,7 +235,6 @@ proc process_path {path fh violation_type slack_list_var harmful_skew_values_var
         }
 
         # Add to harmful paths list
-        set path_name "[get_attribute $startpoint full_name] -> [get_attribute $endpoint full_name]"
         set formatted_line [format "%-80s | %8.3f | %8.3f | %-6s | %8.3f" \
                             $path_name $skew $slack $violation_type $harmful_skew]
         lappend harmful_paths $formatted_line
@@ -243,8 +243,8 @@ proc process_path {path fh violation_type slack_list_var harmful_skew_values_var
     # Output results immediately
     puts [format "%-80s | %8.3f | %8.3f | %-6s | %8.3f" \
           $path_name $skew $slack $violation_type $harmful_skew]
-    puts $fh [format "%-80s | %8.3f | %8.3f | %-6s | %8.3f" \
-              $path_name $skew $slack $violation_type $harmful_skew]
+    puts $fh [format "%-80s | %8.3f | %8.3f | %-6s | %8.3f | %s" \
+              $path_name $skew $slack $violation_type $harmful_skew $launch_clock_name]
 
     return [expr {$harmful_skew > 0 ? 1 : 0}]
 }
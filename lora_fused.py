@@ -0,0 +1,321 @@
+import time
+import types
+
+import torch
+from torch import nn
+from peft.tuners.lora import Linear as LoraLinear
+
+try:
+    from peft.tuners.lora.bnb import Linear4bit, Linear8bitLt
+    fusable_lora_types = (LoraLinear, Linear8bitLt, Linear4bit)
+except ImportError:
+    # bitsandbytes not installed
+    fusable_lora_types = (LoraLinear,)
+
+# Projections that read the same input tensor inside one decoder layer,
+# so their LoRA A matrices can be applied with a single matmul
+shared_input_groups = (
+    ('q_proj', 'k_proj', 'v_proj'),
+    ('gate_proj', 'up_proj'),
+)
+
+
+def _can_fuse(layer, x):
+    """True when the fused path computes what the layer's own forward would."""
+    if layer.disable_adapters or layer.merged:
+        return False
+    adapters = layer.active_adapters
+    if len(adapters) != 1 or adapters[0] not in layer.lora_A:
+        return False
+    adapter = adapters[0]
+    if layer.use_dora.get(adapter, False):
+        return False
+    return x.is_floating_point()
+
+
+def _version(tensor):
+    # Inference tensors have no version counter; identity has to do
+    return None if tensor.is_inference() else tensor._version
+
+
+def _reuse_buffer(buffer, shape, like):
+    """buffer if it can hold the result, else a new one."""
+    if (buffer is None or buffer.shape != shape or buffer.dtype != like.dtype or buffer.device != like.device
+            # One allocated under inference_mode can't be written outside it
+            or (buffer.is_inference() and not torch.is_inference_mode_enabled())):
+        buffer = torch.empty(shape, dtype=like.dtype, device=like.device)
+    return buffer
+
+
+def _low_rank(layer, x2d, lora_A):
+    """x @ A^T, written into a reused buffer when no graph is being recorded."""
+    if torch.is_grad_enabled() and (x2d.requires_grad or lora_A.requires_grad):
+        return torch.mm(x2d, lora_A.t())
+    shape = (x2d.shape[0], lora_A.shape[0])
+    buffer = _reuse_buffer(getattr(layer, '_lora_xa_buffer', None), shape, x2d)
+    layer._lora_xa_buffer = buffer
+    return torch.mm(x2d, lora_A.t(), out=buffer)
+
+
+class SharedInputLoraGroup:
+    """
+    Compute x @ [A_q; A_k; A_v]^T once for projections that share an input.
+
+    The first member called with a given input tensor runs one matmul
+    against the concatenated A matrices; the other members get column
+    slices of that result. The cache is keyed on the input tensor's
+    identity and version (identity alone for inference tensors, which
+    have no version counter), and dropped once every member has consumed it.
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+        self._input = None
+        self._input_version = None
+        self._projected = None
+        self._remaining = set()
+        self._weight = None
+        self._weight_key = None
+        self._buffer = None
+
+    def _slices(self, adapter):
+        offset = 0
+        slices = {}
+        for layer in self.layers:
+            rank = layer.lora_A[adapter].weight.shape[0]
+            slices[id(layer)] = (offset, offset + rank)
+            offset += rank
+        return slices
+
+    def _concatenated_weight(self, adapter, dtype):
+        weights = [layer.lora_A[adapter].weight for layer in self.layers]
+        if torch.is_grad_enabled() and any(w.requires_grad for w in weights):
+            # Has to be part of the graph so each A receives its gradient
+            return torch.cat(weights).to(dtype)
+        # A copy made under inference_mode can't be saved for backward later
+        key = (adapter, dtype, torch.is_inference_mode_enabled())
+        key += tuple((w.data_ptr(), _version(w)) for w in weights)
+        if key != self._weight_key:
+            self._weight = torch.cat(weights).to(dtype)
+            self._weight_key = key
+        return self._weight
+
+    def project(self, layer, x, x2d, adapter):
+        fresh = (
+            self._input is not x
+            or self._input_version != _version(x)
+            or id(layer) not in self._remaining
+        )
+        if fresh:
+            weight = self._concatenated_weight(adapter, x2d.dtype)
+            if torch.is_grad_enabled() and (x2d.requires_grad or weight.requires_grad):
+                self._projected = torch.mm(x2d, weight.t())
+            else:
+                self._buffer = _reuse_buffer(self._buffer, (x2d.shape[0], weight.shape[0]), x2d)
+                self._projected = torch.mm(x2d, weight.t(), out=self._buffer)
+            self._input = x
+            self._input_version = _version(x)
+            self._remaining = {id(member) for member in self.layers}
+
+        start, end = self._slices(adapter)[id(layer)]
+        projected = self._projected[:, start:end]
+        self._remaining.discard(id(layer))
+        if not self._remaining:
+            # Don't keep the layer input alive past its last consumer
+            self._input = None
+            self._projected = None
+        return projected
+
+
+def fused_lora_forward(self, x, *args, **kwargs):
+    """
+    Drop-in replacement for peft's LoraLinear.forward.
+
+    Computes base(x) + scaling * (x A^T) B^T with the scaled low-rank
+    update accumulated into the base output by one in-place addmm, so
+    the separate B output, the scaled copy and the add are never
+    materialized.
+    """
+    if args or kwargs or not _can_fuse(self, x):
+        return type(self).forward(self, x, *args, **kwargs)
+
+    adapter = self.active_adapters[0]
+    lora_A = self.lora_A[adapter].weight
+    lora_B = self.lora_B[adapter].weight
+    scaling = self.scaling[adapter]
+    base = self.base_layer
+
+    x2d = x.reshape(-1, x.shape[-1])
+    x_lora = x2d.to(lora_A.dtype)
+    dropout = self.lora_dropout[adapter]
+    group = getattr(self, '_lora_input_group', None)
+    if self.training and not isinstance(dropout, nn.Identity):
+        # Each projection draws its own dropout mask, so A can't be shared
+        xa = _low_rank(self, dropout(x_lora), lora_A)
+    elif group is not None:
+        xa = group.project(self, x, x_lora, adapter)
+    else:
+        xa = _low_rank(self, x_lora, lora_A)
+
+    if type(base) is nn.Linear and base.weight.dtype == x.dtype == lora_B.dtype:
+        if base.bias is not None:
+            out = torch.addmm(base.bias, x2d, base.weight.t())
+        else:
+            out = torch.mm(x2d, base.weight.t())
+        out.addmm_(xa, lora_B.t(), alpha=scaling)
+    else:
+        # Quantized or mixed-dtype base: add the update in the LoRA dtype
+        # and cast back, as LoraLinear does (the bnb variants round the
+        # update to the base dtype first, so they match to fp16 precision)
+        result = base(x)
+        out = result.reshape(-1, lora_B.shape[0]).to(lora_B.dtype)
+        out = torch.addmm(out, xa, lora_B.t(), alpha=scaling).to(result.dtype)
+    return out.view(*x.shape[:-1], lora_B.shape[0])
+
+
+def fuse_lora_layers(model, group_shared_inputs=True):
+    """
+    Switch every peft LoRA linear layer in the model to the fused forward.
+
+    Parameters and state_dict keys are untouched, so training,
+    save_pretrained() and merging work exactly as before.
+
+    Args:
+        model: A PeftModel (or any module containing LoraLinear layers).
+        group_shared_inputs (bool): Batch the A projections of q/k/v and
+            gate/up, which read the same input.
+
+    Returns:
+        int: Number of layers switched.
+    """
+    fused = 0
+    for parent in model.modules():
+        for layer in parent.children():
+            if type(layer) in fusable_lora_types:
+                layer.forward = types.MethodType(fused_lora_forward, layer)
+                fused += 1
+        if not group_shared_inputs:
+            continue
+        for names in shared_input_groups:
+            members = [getattr(parent, n, None) for n in names]
+            members = [m for m in members if type(m) in fusable_lora_types]
+            if len(members) > 1:
+                group = SharedInputLoraGroup(members)
+                for member in members:
+                    member._lora_input_group = group
+    return fused
+
+
+def unfuse_lora_layers(model):
+    """Restore peft's own forward on every layer switched by fuse_lora_layers()."""
+    for layer in model.modules():
+        if type(layer) in fusable_lora_types:
+            layer.__dict__.pop('forward', None)
+            layer.__dict__.pop('_lora_input_group', None)
+            layer.__dict__.pop('_lora_xa_buffer', None)
+
+
+def _train_step(model, input_ids):
+    loss = model(input_ids=input_ids, labels=input_ids).loss
+    loss.backward()
+    return loss
+
+
+def check_equivalence(model, input_ids, atol=1e-5, rtol=1e-4):
+    """
+    Compare logits and LoRA gradients of the fused and peft forwards.
+
+    Returns:
+        float: Largest absolute difference seen.
+    """
+    model.train()
+    unfuse_lora_layers(model)
+    model.zero_grad(set_to_none=True)
+    ref_logits = model(input_ids=input_ids).logits
+    _train_step(model, input_ids)
+    ref_grads = {n: p.grad.clone() for n, p in model.named_parameters() if p.grad is not None}
+
+    fuse_lora_layers(model)
+    model.zero_grad(set_to_none=True)
+    logits = model(input_ids=input_ids).logits
+    _train_step(model, input_ids)
+    grads = {n: p.grad for n, p in model.named_parameters() if p.grad is not None}
+
+    max_diff = (logits - ref_logits).abs().max().item()
+    torch.testing.assert_close(logits, ref_logits, atol=atol, rtol=rtol)
+    for name, ref in ref_grads.items():
+        torch.testing.assert_close(grads[name], ref, atol=atol, rtol=rtol)
+        max_diff = max(max_diff, (grads[name] - ref).abs().max().item())
+    model.zero_grad(set_to_none=True)
+    return max_diff
+
+
+def benchmark_step(model, input_ids, steps=10):
+    """
+    Time forward + backward and measure allocator traffic with the profiler.
+
+    Returns:
+        dict: {"step_time", "allocated_mb", "allocations"}
+    """
+    from torch.profiler import ProfilerActivity, profile
+
+    model.train()
+    _train_step(model, input_ids)
+    model.zero_grad(set_to_none=True)
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        _train_step(model, input_ids)
+        model.zero_grad(set_to_none=True)
+    step_time = (time.perf_counter() - start) / steps
+
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        _train_step(model, input_ids)
+        model.zero_grad(set_to_none=True)
+    allocations = [e for e in prof.events() if e.self_cpu_memory_usage > 0]
+    return {
+        'step_time': step_time,
+        'allocated_mb': sum(e.self_cpu_memory_usage for e in allocations) / 1024 / 1024,
+        'allocations': len(allocations),
+    }
+
+
+if __name__ == "__main__":
+    from peft import LoraConfig, get_peft_model
+    from transformers import LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(3407)
+    # A small Llama with the same seven LoRA targets as finetunningllmmodel.py
+    config = LlamaConfig(
+        vocab_size=2048, hidden_size=512, intermediate_size=1408,
+        num_hidden_layers=4, num_attention_heads=8, num_key_value_heads=8,
+    )
+    model = LlamaForCausalLM(config)
+    lora_config = LoraConfig(
+        r=16,
+        lora_alpha=16,
+        target_modules=["q_proj", "k_proj", "v_proj", "o_proj",
+                        "gate_proj", "up_proj", "down_proj"],
+        lora_dropout=0,
+        bias="none",
+        task_type="CAUSAL_LM",
+    )
+    model = get_peft_model(model, lora_config)
+    # PEFT initializes B to zero; perturb it so the check exercises the update
+    with torch.no_grad():
+        for name, p in model.named_parameters():
+            if 'lora_B' in name:
+                p.normal_(std=0.02)
+
+    input_ids = torch.randint(0, config.vocab_size, (4, 256))
+    print(f"[INFO] Max |fused - peft| difference: {check_equivalence(model, input_ids):.2e}")
+
+    unfuse_lora_layers(model)
+    peft_stats = benchmark_step(model, input_ids)
+    fuse_lora_layers(model)
+    fused_stats = benchmark_step(model, input_ids)
+
+    print(f"{'':>6} | {'step (ms)':>10} | {'alloc (MB)':>10} | {'allocs':>7}")
+    for label, stats in (('peft', peft_stats), ('fused', fused_stats)):
+        print(f"{label:>6} | {stats['step_time'] * 1000:10.1f} | "
+              f"{stats['allocated_mb']:10.1f} | {stats['allocations']:7d}")
@@ -0,0 +1,351 @@
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from torch import nn
+from torch.utils.checkpoint import checkpoint
+from transformers import TrainerCallback
+
+# Which sub-module of each decoder layer a policy recomputes in backward
+checkpoint_policies = {
+    'mlp': ('mlp',),
+    'attention': ('self_attn',),
+    'layer': (None,),
+}
+
+
+def _checkpointed_forward(self, *args, **kwargs):
+    # Only the module's inputs are kept for backward; its internal
+    # activations are recomputed. In eval mode it is a plain call.
+    if self.training and torch.is_grad_enabled():
+        return checkpoint(self._unchecked_forward, *args, use_reentrant=False, **kwargs)
+    return self._unchecked_forward(*args, **kwargs)
+
+
+def _checkpoint_module(module):
+    # Patch forward on the instance (as lora_fused.py does) rather than
+    # wrapping the module, so parameter names and state_dict keys, and
+    # hence save_pretrained() checkpoints, are unchanged
+    if '_unchecked_forward' in module.__dict__:
+        return False
+    module._unchecked_forward = module.forward
+    module.forward = types.MethodType(_checkpointed_forward, module)
+    return True
+
+
+def _uncheckpoint_module(module):
+    original = module.__dict__.pop('_unchecked_forward', None)
+    if original is None:
+        return
+    if getattr(original, '__func__', None) is type(module).forward:
+        module.__dict__.pop('forward', None)
+    else:
+        module.forward = original
+
+
+def _decoder_layers(model):
+    """Find the ModuleList of transformer blocks (model.model.layers for Llama/Qwen)."""
+    for name, module in model.named_modules():
+        if isinstance(module, nn.ModuleList) and name.split('.')[-1] in ('layers', 'h'):
+            return module
+    raise ValueError(f"Could not find decoder layers in {type(model).__name__}")
+
+
+def apply_activation_checkpointing(model, policy='mlp', layers=None):
+    """
+    Selectively checkpoint part of each decoder layer.
+
+    Unlike `gradient_checkpointing=True`, which recomputes whole layers,
+    this lets you pick what gets recomputed: e.g. "mlp" keeps the cheap
+    attention activations resident and recomputes only the MLP, whose
+    intermediates are the largest (4-5x hidden size).
+
+    Args:
+        model: A causal LM (or a PEFT model wrapping one).
+        policy (str): One of "mlp", "attention" or "layer".
+        layers (iterable of int): Decoder layer indices to checkpoint;
+            None means all of them.
+
+    Returns:
+        int: Number of modules checkpointed.
+    """
+    if policy not in checkpoint_policies:
+        raise ValueError(f"Unknown checkpoint policy {policy!r}, expected one of {list(checkpoint_policies)}")
+
+    decoder_layers = _decoder_layers(model)
+    indices = range(len(decoder_layers)) if layers is None else layers
+    wrapped = 0
+    for i in indices:
+        for attr in checkpoint_policies[policy]:
+            module = decoder_layers[i] if attr is None else getattr(decoder_layers[i], attr)
+            wrapped += _checkpoint_module(module)
+
+    # The KV cache is useless (and wasteful) while recomputing in backward
+    model.config.use_cache = False
+    return wrapped
+
+
+def remove_activation_checkpointing(model):
+    """Undo apply_activation_checkpointing()."""
+    for module in _decoder_layers(model).modules():
+        _uncheckpoint_module(module)
+    model.config.use_cache = True
+
+
+class CPUOffloadAdamW(torch.optim.Optimizer):
+    """
+    AdamW whose moments and fp32 master weights live in host memory.
+
+    The device only keeps the (bf16/fp16) working weights and gradients,
+    which removes 12 bytes/parameter of optimizer state from the GPU. On
+    step() gradients are copied to pinned host buffers and the AdamW
+    update runs on the CPU in a background thread.
+
+    With overlap=True the host update runs while the next forward/backward
+    executes, and its result is copied back at the start of the following
+    step() (a one-step delayed parameter update, as in ZeRO-Offload). With
+    overlap=False step() blocks until the device weights are updated.
+
+    Args:
+        params: Model parameters, or param-group dicts as for
+            torch.optim.AdamW (e.g. no weight decay on biases and norms);
+            parameters without requires_grad are skipped.
+        lr, betas, eps, weight_decay: As for torch.optim.AdamW.
+        overlap (bool): Overlap the host update with the next step.
+    """
+
+    def __init__(self, params, lr=1e-4, betas=(0.9, 0.999), eps=1e-8,
+                 weight_decay=0.01, overlap=True):
+        groups = list(params)
+        if groups and not isinstance(groups[0], dict):
+            groups = [{'params': groups}]
+        groups = [{**group, 'params': [p for p in group['params'] if p.requires_grad]} for group in groups]
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+        super().__init__(groups, defaults)
+
+        # Host groups mirror the device groups; hyperparameters are copied
+        # over on every step
+        pin = torch.cuda.is_available()
+        self.host_params = []
+        host_groups = []
+        for group in self.param_groups:
+            hosts = []
+            for p in group['params']:
+                host = p.detach().to('cpu', dtype=torch.float32, copy=True)
+                if pin:
+                    host = host.pin_memory()
+                host.grad = torch.zeros_like(host, pin_memory=pin)
+                hosts.append(host)
+            self.host_params.extend(hosts)
+            host_groups.append({'params': hosts, **{key: group[key] for key in defaults}})
+
+        self.host_optimizer = torch.optim.AdamW(host_groups, foreach=True)
+        self.overlap = overlap
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    def _device_params(self):
+        return [p for group in self.param_groups for p in group['params']]
+
+    def _host_step(self, grads_ready):
+        if grads_ready is not None:
+            grads_ready.synchronize()
+        # Pick up learning-rate changes made by the scheduler
+        for group, host_group in zip(self.param_groups, self.host_optimizer.param_groups):
+            for key in ('lr', 'betas', 'eps', 'weight_decay'):
+                host_group[key] = group[key]
+        self.host_optimizer.step()
+
+    def flush(self):
+        """Wait for an in-flight host update and copy it to the device weights."""
+        if self._pending is None:
+            return
+        self._pending.result()
+        self._pending = None
+        with torch.no_grad():
+            for p, host in zip(self._device_params(), self.host_params):
+                p.copy_(host, non_blocking=True)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = closure() if closure is not None else None
+        self.flush()
+
+        for p, host in zip(self._device_params(), self.host_params):
+            if p.grad is None:
+                host.grad.zero_()
+            else:
+                host.grad.copy_(p.grad, non_blocking=True)
+
+        grads_ready = None
+        if torch.cuda.is_available():
+            grads_ready = torch.cuda.Event()
+            grads_ready.record()
+        self._pending = self._executor.submit(self._host_step, grads_ready)
+        if not self.overlap:
+            self.flush()
+        return loss
+
+    @torch.no_grad()
+    def sync_from_model(self):
+        """
+        Copy the device weights into the fp32 master weights.
+
+        Needed whenever the model's weights change outside step(), e.g.
+        when a checkpoint is loaded to resume training; otherwise the next
+        update would be applied to the stale host copy and overwrite them.
+        Any in-flight update is discarded.
+        """
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+        for p, host in zip(self._device_params(), self.host_params):
+            host.copy_(p.detach().float())
+
+    def state_dict(self):
+        self.flush()
+        return self.host_optimizer.state_dict()
+
+    def load_state_dict(self, state_dict):
+        # Trainer restores the model weights before the optimizer state
+        self.sync_from_model()
+        self.host_optimizer.load_state_dict(state_dict)
+
+
+def use_offload_optimizer(trainer, **kwargs):
+    """
+    Give a Trainer a CPUOffloadAdamW and the callback that flushes it.
+
+    Parameters are grouped the way the Trainer's own optimizer groups
+    them: weight decay on everything except biases and norm weights
+    (trainer.get_decay_parameter_names).
+
+    Args:
+        trainer: A Trainer (or SFTTrainer) built without an optimizer.
+        kwargs: Passed to CPUOffloadAdamW (e.g. overlap).
+
+    Returns:
+        CPUOffloadAdamW: The optimizer, also set as trainer.optimizer.
+    """
+    model = trainer.model
+    decay = set(trainer.get_decay_parameter_names(model))
+    named = [(n, p) for n, p in model.named_parameters() if p.requires_grad]
+    groups = [
+        {'params': [p for n, p in named if n in decay], 'weight_decay': trainer.args.weight_decay},
+        {'params': [p for n, p in named if n not in decay], 'weight_decay': 0.0},
+    ]
+    optimizer = CPUOffloadAdamW(groups, lr=trainer.args.learning_rate, **kwargs)
+    trainer.optimizer = optimizer
+    trainer.add_callback(OffloadFlushCallback(optimizer))
+    return optimizer
+
+
+class OffloadFlushCallback(TrainerCallback):
+    """
+    Apply the last delayed CPUOffloadAdamW update before evaluation and saving.
+
+    Trainer evaluates and saves right after on_step_end (step strategies)
+    or on_epoch_end (epoch strategies), so the flush happens there. There
+    is deliberately no flush in on_train_end: it runs after
+    load_best_model_at_end has restored the best checkpoint, which a late
+    update would overwrite. The final step is flushed in on_step_end instead.
+    """
+
+    def __init__(self, optimizer):
+        self.optimizer = optimizer
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if control.should_save or control.should_evaluate or control.should_training_stop:
+            self.optimizer.flush()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        self.optimizer.flush()
+
+
+def measure_setting(model, optimizer, batch_size, context_length, steps=5):
+    """
+    Run a few full optimizer steps and report peak memory and throughput.
+
+    Returns:
+        dict: {"peak_memory_gb", "tokens_per_sec"}; peak_memory_gb is None
+              on CPU, where the allocator keeps no resettable peak.
+    """
+    device = next(model.parameters()).device
+    model.train()
+    input_ids = torch.randint(0, model.config.vocab_size, (batch_size, context_length), device=device)
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+
+    # One warmup step so the AdamW state exists before timing
+    for step in range(steps + 1):
+        if step == 1:
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            start = time.perf_counter()
+        loss = model(input_ids=input_ids, labels=input_ids).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+    if isinstance(optimizer, CPUOffloadAdamW):
+        optimizer.flush()
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    elapsed = time.perf_counter() - start
+
+    peak = None
+    if device.type == 'cuda':
+        peak = torch.cuda.max_memory_allocated(device) / 1024 / 1024 / 1024
+    return {
+        'peak_memory_gb': peak,
+        'tokens_per_sec': steps * batch_size * context_length / elapsed,
+    }
+
+
+def sweep(model, batch_size, context_length, learning_rate=1e-4, steps=5,
+          policies=(None, 'mlp', 'attention', 'layer'), offload_options=(False, True)):
+    """
+    Measure every (checkpoint policy, optimizer offload) combination.
+
+    Returns:
+        list of dict: One row per setting with peak_memory_gb and tokens_per_sec.
+    """
+    rows = []
+    for policy in policies:
+        if policy is not None:
+            apply_activation_checkpointing(model, policy)
+        for offload in offload_options:
+            if offload:
+                optimizer = CPUOffloadAdamW(model.parameters(), lr=learning_rate)
+            else:
+                optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
+            try:
+                result = measure_setting(model, optimizer, batch_size, context_length, steps)
+            except torch.cuda.OutOfMemoryError:
+                result = {'peak_memory_gb': float('nan'), 'tokens_per_sec': 0.0}
+            del optimizer
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            rows.append({'policy': policy or 'none', 'offload': offload, **result})
+            peak = result['peak_memory_gb']
+            memory = 'unknown' if peak is None else f"{peak:8.2f} GB"
+            print(f"{rows[-1]['policy']:>10} | offload={str(offload):5} | "
+                  f"{memory:>11} | {result['tokens_per_sec']:10,.0f} tokens/sec")
+        remove_activation_checkpointing(model)
+    return rows
+
+
+if __name__ == "__main__":
+    from transformers import AutoModelForCausalLM
+
+    from model_store import model_path
+
+    model_name = model_path('Qwen/Qwen1.5-0.5B')
+    batch_size = 2
+    context_length = 512
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.bfloat16).to(device)
+    print("    policy | offload       |  peak mem  |  throughput")
+    sweep(model, batch_size, context_length)
@@ -0,0 +1,380 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+# Content-addressed store:
+#   objects/ab/abcdef...            one read-only blob per distinct file (sha256)
+#   snapshots/<kind>/<name>/<rev>/  directory trees of hard links to blobs
+#   manifest.json                   name -> revision -> path and file hashes
+store_dir = os.environ.get('MODEL_STORE', 'model_store')
+manifest_name = 'manifest.json'
+hash_block_size = 8 * 1024 * 1024
+
+_sha256_name = re.compile(r'[0-9a-f]{64}')
+
+
+def load_manifest(store=store_dir):
+    """Imported models and datasets; no network access."""
+    path = os.path.join(store, manifest_name)
+    if not os.path.exists(path):
+        return {'models': {}, 'datasets': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest, store):
+    path = os.path.join(store, manifest_name)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def file_sha256(path):
+    """
+    sha256 of a file's contents.
+
+    Hub cache blobs of LFS files (the weight shards) are already named by
+    their sha256, so those are taken from the name instead of re-read.
+    """
+    real = os.path.realpath(path)
+    if '/blobs/' in real and _sha256_name.fullmatch(os.path.basename(real)):
+        return os.path.basename(real)
+    digest = hashlib.sha256()
+    with open(real, 'rb') as f:
+        while block := f.read(hash_block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _link(src, dst):
+    # Hard links share the blob's pages, so several snapshots of the same
+    # shard are mapped once; fall back across filesystems
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _add_object(path, store, link_source):
+    """Add a file to objects/ unless identical content is already there."""
+    sha = file_sha256(path)
+    obj = os.path.join(store, 'objects', sha[:2], sha)
+    if os.path.exists(obj):
+        return sha, 0
+    os.makedirs(os.path.dirname(obj), exist_ok=True)
+    tmp = f"{obj}.tmp"
+    if link_source:
+        # A hard link shares the source's inode, so its mode is left
+        # alone; changing it would also change the Hub cache's blob
+        _link(os.path.realpath(path), tmp)
+    else:
+        shutil.copyfile(path, tmp)
+        os.chmod(tmp, 0o444)
+    os.replace(tmp, obj)
+    return sha, os.path.getsize(obj)
+
+
+def _import_tree(source_dir, kind, name, revision, store, link_source=True):
+    """
+    Hash every file under source_dir into the store and link a snapshot.
+
+    Sources are hard-linked into objects/ only when they are never
+    rewritten in place (Hub cache blobs, staging directories); anything
+    else is copied so a later overwrite can't change a stored blob.
+
+    Returns:
+        dict: The manifest entry, with bytes added vs. deduplicated.
+    """
+    snapshot = os.path.join('snapshots', kind, name.replace('/', '--'), revision)
+    target = os.path.join(store, snapshot)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+
+    files, added, deduped = {}, 0, 0
+    for root, _, names in os.walk(source_dir, followlinks=True):
+        for filename in names:
+            path = os.path.join(root, filename)
+            rel = os.path.relpath(path, source_dir)
+            if rel.startswith('.cache'):
+                continue
+            sha, new_bytes = _add_object(path, store, link_source)
+            files[rel] = sha
+            added += new_bytes
+            if not new_bytes:
+                deduped += os.path.getsize(path)
+            dst = os.path.join(target, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            _link(os.path.join(store, 'objects', sha[:2], sha), dst)
+
+    manifest = load_manifest(store)
+    entry = {'path': snapshot, 'files': files, 'imported': time.strftime('%Y-%m-%d %H:%M:%S')}
+    record = manifest[kind].setdefault(name, {'revisions': {}})
+    record['revisions'][revision] = entry
+    record['default'] = revision
+    _save_manifest(manifest, store)
+    return {'name': name, 'revision': revision, 'files': len(files), 'added_bytes': added, 'deduped_bytes': deduped}
+
+
+def import_model(name, revision='main', store=store_dir):
+    """
+    Import a model snapshot once; later loads resolve to the store.
+
+    Args:
+        name (str): Hub repo id, or a local directory (e.g. outputs/merged_model).
+        revision (str): Hub branch, tag or commit.
+        store (str): Store directory.
+    """
+    if os.path.isdir(name):
+        return _import_tree(name, 'models', name.rstrip('/'), 'local', store, link_source=False)
+    from huggingface_hub import snapshot_download
+
+    path = snapshot_download(name, revision=revision)
+    # The snapshot directory is named by the resolved commit
+    return _import_tree(path, 'models', name, os.path.basename(path), store)
+
+
+def import_dataset(name, store=store_dir, **kwargs):
+    """
+    Import a dataset once as Arrow files, which load_from_disk memory-maps.
+
+    Args:
+        name (str): Hub dataset id, as passed to load_dataset().
+        kwargs: Passed to load_dataset() (e.g. a config name).
+    """
+    from datasets import load_dataset
+
+    return _import_dataset_object(load_dataset(name, **kwargs), name, store)
+
+
+def _import_dataset_object(dataset, name, store):
+    splits = dataset.values() if hasattr(dataset, 'values') else [dataset]
+    fingerprint = hashlib.sha256(''.join(d._fingerprint for d in splits).encode()).hexdigest()[:16]
+    # Stage inside the store so the Arrow files can be hard-linked in
+    os.makedirs(store, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=store) as tmp:
+        dataset.save_to_disk(tmp)
+        return _import_tree(tmp, 'datasets', name, fingerprint, store)
+
+
+def resolve(name, kind='models', revision=None, store=store_dir):
+    """
+    Local path of an imported model or dataset, from the manifest alone.
+
+    Returns:
+        str or None: Snapshot directory, or None if the name was never imported.
+    """
+    record = load_manifest(store)[kind].get(name)
+    if record is None:
+        return None
+    entry = record['revisions'].get(revision or record['default'])
+    return None if entry is None else os.path.join(store, entry['path'])
+
+
+def model_path(name, revision=None, store=store_dir):
+    """Store path for a model if imported, else the name unchanged for from_pretrained()."""
+    return resolve(name, 'models', revision, store) or name
+
+
+def load_local_dataset(name, split=None, store=store_dir, **kwargs):
+    """
+    load_dataset() that reads the store's memory-mapped copy when there is one.
+
+    Args:
+        name (str): Hub dataset id.
+        split (str): Optional split to return, as for load_dataset().
+        kwargs: Passed to load_dataset() when falling back to the Hub.
+    """
+    path = resolve(name, 'datasets', store=store)
+    if path is None:
+        from datasets import load_dataset
+        return load_dataset(name, split=split, **kwargs)
+    from datasets import load_from_disk
+
+    dataset = load_from_disk(path)
+    return dataset[split] if split else dataset
+
+
+def gc(store=store_dir):
+    """Delete blobs no manifest revision references; returns bytes freed."""
+    manifest = load_manifest(store)
+    referenced = {
+        sha
+        for kind in ('models', 'datasets')
+        for record in manifest[kind].values()
+        for entry in record['revisions'].values()
+        for sha in entry['files'].values()
+    }
+    freed = 0
+    objects = os.path.join(store, 'objects')
+    for root, _, names in os.walk(objects):
+        for filename in names:
+            if filename not in referenced:
+                path = os.path.join(root, filename)
+                freed += os.path.getsize(path)
+                os.remove(path)
+    return freed
+
+
+class NetworkBlocked(RuntimeError):
+    """Raised by the socket layer while block_network() is active."""
+
+
+class block_network:
+    """Context manager that makes every socket connection or DNS lookup fail."""
+
+    def __enter__(self):
+        def _blocked(*args, **kwargs):
+            raise NetworkBlocked(f"network access attempted: {args[1:] or args}")
+
+        self._saved = (socket.socket.connect, socket.socket.connect_ex, socket.create_connection, socket.getaddrinfo)
+        socket.socket.connect = socket.socket.connect_ex = _blocked
+        socket.create_connection = socket.getaddrinfo = _blocked
+        return self
+
+    def __exit__(self, *exc):
+        socket.socket.connect, socket.socket.connect_ex, socket.create_connection, socket.getaddrinfo = self._saved
+        return False
+
+
+def _open_model(path):
+    # Config, tokenizer and a memory-mapped view of every weight shard;
+    # the tensors themselves are paged in on first use
+    from safetensors import safe_open
+    from transformers import AutoConfig, AutoTokenizer
+
+    AutoConfig.from_pretrained(path)
+    AutoTokenizer.from_pretrained(path)
+    for root, _, names in os.walk(path):
+        for filename in names:
+            if filename.endswith('.safetensors'):
+                with safe_open(os.path.join(root, filename), framework='pt') as f:
+                    list(f.keys())
+
+
+def _open_dataset(path):
+    from datasets import load_from_disk
+
+    load_from_disk(path)
+
+
+def verify_offline(store=store_dir):
+    """
+    Open everything in the store with sockets blocked.
+
+    Each model and dataset is opened normally (a warm local read), then
+    again with every connection and DNS lookup raising
+    NetworkBlocked, so any hidden Hub call fails loudly.
+
+    Returns:
+        list of dict: Per item, warm and network-blocked open times.
+    """
+    manifest = load_manifest(store)
+    results = []
+    for kind, opener in (('models', _open_model), ('datasets', _open_dataset)):
+        for name in manifest[kind]:
+            path = resolve(name, kind, store=store)
+            # Untimed first open pulls the files and libraries into memory
+            opener(path)
+            start = time.perf_counter()
+            opener(path)
+            warm = time.perf_counter() - start
+            with block_network():
+                start = time.perf_counter()
+                opener(resolve(name, kind, store=store))
+                offline = time.perf_counter() - start
+            results.append({'kind': kind, 'name': name, 'warm': warm, 'offline': offline})
+    return results
+
+
+def _write_tiny_model(path):
+    # A randomly initialised one-layer Llama and a word-level tokenizer,
+    # so the check needs no download
+    from tokenizers import Tokenizer
+    from tokenizers.models import WordLevel
+    from tokenizers.pre_tokenizers import Whitespace
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    vocab = {word: i for i, word in enumerate(['<unk>', '<s>', '</s>', 'module', 'endmodule', 'input', 'output'])}
+    tokenizer = Tokenizer(WordLevel(vocab, unk_token='<unk>'))
+    tokenizer.pre_tokenizer = Whitespace()
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer, unk_token='<unk>', bos_token='<s>',
+                            eos_token='</s>').save_pretrained(path)
+    config = LlamaConfig(vocab_size=len(vocab), hidden_size=16, intermediate_size=32, num_hidden_layers=1,
+                         num_attention_heads=2, num_key_value_heads=2)
+    LlamaForCausalLM(config).save_pretrained(path)
+
+
+def check_offline_loads(slowdown_limit=2.0, slack=0.05):
+    """
+    Build a throwaway store from a tiny local model and dataset, then
+    resolve and load both with the network blocked.
+
+    Asserts that nothing reaches for the network and that each
+    network-blocked open takes at most slowdown_limit x the warm open
+    (plus slack seconds, for timer noise on millisecond opens).
+    """
+    from datasets import Dataset
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = os.path.join(tmp, 'store')
+        source = os.path.join(tmp, 'tiny-model')
+        _write_tiny_model(source)
+        import_model(source, store=store)
+        dataset = Dataset.from_dict({'instruction': ['counter', 'mux'], 'output': ['module a;', 'module b;']})
+        _import_dataset_object(dataset, 'local/tiny-dataset', store)
+
+        with block_network():
+            path = model_path(source, store=store)
+            assert path != source, "model did not resolve to the store"
+            AutoModelForCausalLM.from_pretrained(path)
+            AutoTokenizer.from_pretrained(path)
+            loaded = load_local_dataset('local/tiny-dataset', store=store)
+            assert loaded['output'] == dataset['output']
+
+        for r in verify_offline(store):
+            limit = slowdown_limit * r['warm'] + slack
+            assert r['offline'] <= limit, (
+                f"{r['name']}: network-blocked open took {r['offline']:.3f}s, over {limit:.3f}s")
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python model_store.py import-model Qwen/Qwen1.5-0.5B [revision]
+    #   python model_store.py import-dataset sahil2801/CodeAlpaca-20k
+    #   python model_store.py list
+    #   python model_store.py verify
+    #   python model_store.py gc
+    #   python model_store.py check
+    command = sys.argv[1] if len(sys.argv) > 1 else 'list'
+    if command in ('import-model', 'import-dataset'):
+        if command == 'import-model':
+            result = import_model(sys.argv[2], *sys.argv[3:4])
+        else:
+            result = import_dataset(sys.argv[2])
+        print(f"[INFO] Imported {result['name']}@{result['revision']}: {result['files']} files, "
+              f"{result['added_bytes'] / 2**20:.1f} MB added, {result['deduped_bytes'] / 2**20:.1f} MB deduplicated")
+    elif command == 'list':
+        manifest = load_manifest()
+        for kind in ('models', 'datasets'):
+            for name, record in manifest[kind].items():
+                print(f"{kind[:-1]:<8} {name:<50} {', '.join(record['revisions'])} (default {record['default']})")
+    elif command == 'verify':
+        for r in verify_offline():
+            print(f"{r['kind'][:-1]:<8} {r['name']:<50} warm {r['warm'] * 1e3:8.1f} ms | "
+                  f"network blocked {r['offline'] * 1e3:8.1f} ms")
+        print("[INFO] All store entries opened with the network blocked")
+    elif command == 'check':
+        check_offline_loads()
+        print("[INFO] Store round trip loads offline within the warm-load bound")
+    elif command == 'gc':
+        print(f"[INFO] Freed {gc() / 2**20:.1f} MB")
+    else:
+        print(f"Unknown command {command!r}")
+        sys.exit(1)
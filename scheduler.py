@@ -0,0 +1,358 @@
+import heapq
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+# Lower number is served first
+priority_classes = {'interactive': 0, 'default': 1, 'batch': 2}
+max_queue = 32
+max_queued_per_client = 4
+default_deadline = 60.0
+# Don't start a generation that can't produce at least this many tokens in time
+min_new_tokens = 16
+# Prior for the decode rate until real requests have been measured
+initial_tokens_per_sec = 20.0
+initial_prefill_time = 0.5
+
+
+class Rejected(Exception):
+    """Raised immediately when a request is shed instead of queued."""
+
+
+class _Request:
+    __slots__ = ('prompt', 'client', 'priority', 'deadline', 'max_new_tokens', 'arrival', 'future')
+
+    def __init__(self, prompt, client, priority, deadline, max_new_tokens):
+        self.prompt = prompt
+        self.client = client
+        self.priority = priority
+        self.deadline = deadline
+        self.max_new_tokens = max_new_tokens
+        self.arrival = time.monotonic()
+        self.future = Future()
+
+
+class GenerationScheduler:
+    """
+    Bounded, fair, deadline-aware queue in front of a generate function.
+
+    Requests are ordered by priority class, then by per-client virtual
+    time (start-time fair queuing), so one client flooding the endpoint
+    only delays its own requests. Admission fails fast with Rejected when
+    the queue or the client's share of it is full, or when the estimated
+    wait already exceeds the request's deadline. At dispatch,
+    max_new_tokens is capped to what the measured decode rate can finish
+    before the deadline.
+
+    Args:
+        generate_fn: Called as generate_fn(prompt, max_new_tokens); returns
+            the text, or (text, new_tokens) so the decode rate can be measured.
+        num_workers (int): Generations run concurrently (1 for one GPU).
+        max_queue (int): Requests waiting across all clients.
+        max_queued_per_client (int): Requests waiting per client.
+    """
+
+    def __init__(self, generate_fn, num_workers=1, max_queue=max_queue,
+                 max_queued_per_client=max_queued_per_client):
+        self.generate_fn = generate_fn
+        self.max_queue = max_queue
+        self.max_queued_per_client = max_queued_per_client
+        self.tokens_per_sec = initial_tokens_per_sec
+        self.prefill_time = initial_prefill_time
+        self.stats = {'admitted': 0, 'rejected': 0, 'completed': 0, 'deadline_missed': 0}
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._client_finish = {}
+        self._client_queued = {}
+        # Generations in progress: seq -> (dispatch time, max_new_tokens)
+        self._running = {}
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._workers = [
+            threading.Thread(target=self._worker_loop, daemon=True) for _ in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _service_time(self, max_new_tokens):
+        return self.prefill_time + max_new_tokens / self.tokens_per_sec
+
+    def _estimated_wait(self, priority):
+        # When each worker frees up: the remaining budget of what it is
+        # running now, then the work queued at the same or higher
+        # priority, each handed to the first free worker
+        now = time.monotonic()
+        free_at = [
+            max(0.0, dispatched + self._service_time(budget) - now)
+            for dispatched, budget in self._running.values()
+        ]
+        free_at += [0.0] * (len(self._workers) - len(free_at))
+        heapq.heapify(free_at)
+        for key, _, r in sorted(self._heap):
+            if key[0] <= priority:
+                heapq.heapreplace(free_at, free_at[0] + self._service_time(r.max_new_tokens))
+        return free_at[0]
+
+    def submit(self, prompt, client='anonymous', priority='default',
+               deadline=default_deadline, max_new_tokens=512):
+        """
+        Queue a request and return a Future for its text.
+
+        Args:
+            prompt (str): Passed through to generate_fn.
+            client (str): Identity used for fairness and per-client limits.
+            priority (str): One of priority_classes.
+            deadline (float): Seconds from now the client will wait.
+            max_new_tokens (int): Upper bound; may be lowered to meet the deadline.
+
+        Raises:
+            Rejected: The request was shed.
+        """
+        rank = priority_classes[priority]
+        request = _Request(prompt, client, rank, time.monotonic() + deadline, max_new_tokens)
+        with self._lock:
+            reason = None
+            if len(self._heap) >= self.max_queue:
+                reason = "queue full"
+            elif self._client_queued.get(client, 0) >= self.max_queued_per_client:
+                reason = "too many requests from this client"
+            elif self._estimated_wait(rank) + self._service_time(min_new_tokens) > deadline:
+                reason = "cannot finish before the deadline"
+            if reason is not None:
+                self.stats['rejected'] += 1
+                raise Rejected(reason)
+
+            # Start-time fair queuing: a client's next request starts after
+            # its previous one "finishes" in virtual time
+            start = max(self._virtual_time, self._client_finish.get(client, 0.0))
+            self._client_finish[client] = start + self._service_time(max_new_tokens)
+            self._client_queued[client] = self._client_queued.get(client, 0) + 1
+            heapq.heappush(self._heap, ((rank, start), next(self._seq), request))
+            self.stats['admitted'] += 1
+            self._ready.notify()
+        return request.future
+
+    def generate(self, prompt, **kwargs):
+        """Blocking submit(): returns the text or raises Rejected."""
+        return self.submit(prompt, **kwargs).result()
+
+    def _next_request(self):
+        with self._lock:
+            while True:
+                while not self._heap:
+                    self._ready.wait()
+                (rank, start), seq, request = heapq.heappop(self._heap)
+                if start > self._virtual_time:
+                    self._virtual_time = start
+                    # A finish time at or behind the virtual clock no longer
+                    # delays its client, so drop it rather than keep one
+                    # entry per client ever seen
+                    self._client_finish = {
+                        client: finish for client, finish in self._client_finish.items()
+                        if finish > start
+                    }
+                self._client_queued[request.client] -= 1
+                if not self._client_queued[request.client]:
+                    del self._client_queued[request.client]
+
+                remaining = request.deadline - time.monotonic()
+                budget = int((remaining - self.prefill_time) * self.tokens_per_sec)
+                if budget < min_new_tokens:
+                    self.stats['deadline_missed'] += 1
+                    request.future.set_exception(Rejected("deadline passed while queued"))
+                    continue
+                self._busy += 1
+                max_new_tokens = min(request.max_new_tokens, budget)
+                self._running[seq] = (time.monotonic(), max_new_tokens)
+                return seq, request, max_new_tokens
+
+    def _finish(self, seq):
+        # Called with the lock held
+        self._busy -= 1
+        del self._running[seq]
+        if not self._busy and not self._heap and self._client_finish:
+            # Idle: virtual time catches up with the last finish tag, so
+            # every client starts level again and none need remembering
+            self._virtual_time = max(self._virtual_time, *self._client_finish.values())
+            self._client_finish.clear()
+
+    def _worker_loop(self):
+        while True:
+            seq, request, max_new_tokens = self._next_request()
+            start = time.monotonic()
+            try:
+                result = self.generate_fn(request.prompt, max_new_tokens)
+            except Exception as e:
+                request.future.set_exception(e)
+                with self._lock:
+                    self._finish(seq)
+                continue
+            elapsed = time.monotonic() - start
+
+            text, new_tokens = result if isinstance(result, tuple) else (result, None)
+            with self._lock:
+                self._finish(seq)
+                self.stats['completed'] += 1
+                if new_tokens:
+                    # EWMA over whole requests, prefill included, so the
+                    # rate errs low and prefill_time stays a safety margin
+                    self.tokens_per_sec = 0.8 * self.tokens_per_sec + 0.2 * new_tokens / elapsed
+            request.future.set_result(text)
+
+
+def gradio_handler(scheduler, deadline=default_deadline, priority='interactive'):
+    """
+    Wrap a scheduler as a gr.Interface fn.
+
+    The client identity comes from the Gradio session; shed requests
+    surface as a gr.Error right away instead of waiting in line. API
+    clients can override the priority class and deadline per request
+    with the X-Priority and X-Deadline headers (e.g. "batch" and "300"
+    for offline jobs).
+
+    Args:
+        scheduler: A GenerationScheduler.
+        deadline (float): Seconds a request may take when X-Deadline is absent.
+        priority (str): Class used when X-Priority is absent.
+    """
+    import gradio as gr
+
+    def handler(description, request: gr.Request):
+        client = getattr(request, 'session_hash', None) or getattr(request.client, 'host', 'anonymous')
+        headers = getattr(request, 'headers', None) or {}
+        request_priority = headers.get('x-priority', priority)
+        if request_priority not in priority_classes:
+            raise gr.Error(f"Unknown X-Priority {request_priority!r}, expected one of {list(priority_classes)}")
+        try:
+            request_deadline = float(headers.get('x-deadline', deadline))
+        except ValueError:
+            raise gr.Error(f"X-Deadline must be a number of seconds, got {headers.get('x-deadline')!r}")
+        try:
+            return scheduler.generate(description, client=client, priority=request_priority,
+                                      deadline=request_deadline)
+        except Rejected as e:
+            raise gr.Error(f"Server busy ({e}), please retry shortly.")
+
+    return handler
+
+
+def replay(scheduler, trace):
+    """
+    Replay a request trace against a scheduler and measure service quality.
+
+    Args:
+        scheduler: A GenerationScheduler.
+        trace (list of dict): Requests with "at" (seconds from start),
+            "client", "priority", "deadline" and "max_new_tokens".
+
+    Returns:
+        dict: goodput (requests/sec answered within deadline), p50/p95/p99
+              latency of answered requests overall and p99 per priority
+              class, rejection rate.
+    """
+    results = []
+    lock = threading.Lock()
+    start = time.monotonic()
+
+    def _fire(entry):
+        t0 = time.monotonic()
+        try:
+            scheduler.generate(
+                "prompt", client=entry['client'], priority=entry['priority'],
+                deadline=entry['deadline'], max_new_tokens=entry['max_new_tokens'],
+            )
+            outcome = 'ok'
+        except Rejected:
+            outcome = 'rejected'
+        latency = time.monotonic() - t0
+        with lock:
+            results.append((outcome, latency, entry['deadline'], entry['priority']))
+
+    threads = []
+    for entry in sorted(trace, key=lambda e: e['at']):
+        delay = entry['at'] - (time.monotonic() - start)
+        if delay > 0:
+            time.sleep(delay)
+        thread = threading.Thread(target=_fire, args=(entry,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    duration = time.monotonic() - start
+
+    good = sum(1 for outcome, lat, deadline, _ in results if outcome == 'ok' and lat <= deadline)
+
+    def _pct(p, priority=None):
+        latencies = sorted(
+            lat for outcome, lat, _, prio in results
+            if outcome == 'ok' and priority in (None, prio)
+        )
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+    return {
+        'requests': len(results),
+        'goodput': good / duration,
+        'p50': _pct(50),
+        'p95': _pct(95),
+        'p99': _pct(99),
+        'p99_by_priority': {prio: _pct(99, prio) for prio in sorted({r[3] for r in results})},
+        'rejection_rate': sum(1 for r in results if r[0] == 'rejected') / max(len(results), 1),
+    }
+
+
+def synthetic_trace(rate, duration, clients=8, seed=0):
+    """Poisson arrivals from several clients with mixed priorities and deadlines."""
+    rng = random.Random(seed)
+    trace, t = [], 0.0
+    while True:
+        t += rng.expovariate(rate)
+        if t > duration:
+            return trace
+        interactive = rng.random() < 0.7
+        trace.append({
+            'at': t,
+            # One heavy client sends a third of the traffic
+            'client': 'heavy' if rng.random() < 0.33 else f"client{rng.randrange(clients)}",
+            'priority': 'interactive' if interactive else 'batch',
+            'deadline': rng.uniform(5, 15) if interactive else 60.0,
+            'max_new_tokens': 512,
+        })
+
+
+if __name__ == "__main__":
+    # Usage: python scheduler.py [trace.jsonl]
+    # Replays against a simulated model (prefill + fixed decode rate) so
+    # the scheduler can be exercised without a GPU
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            trace = [json.loads(line) for line in f]
+    else:
+        trace = synthetic_trace(rate=2.0, duration=30)
+
+    simulated_tokens_per_sec = 200.0
+
+    def fake_generate(prompt, max_new_tokens):
+        new_tokens = random.randint(max_new_tokens // 2, max_new_tokens)
+        time.sleep(0.05 + new_tokens / simulated_tokens_per_sec)
+        return "", new_tokens
+
+    scheduler = GenerationScheduler(fake_generate)
+    stats = replay(scheduler, trace)
+    print(f"requests:       {stats['requests']}")
+    print(f"goodput:        {stats['goodput']:.2f} req/s")
+    print(f"latency p50:    {stats['p50']:.2f} s")
+    print(f"latency p95:    {stats['p95']:.2f} s")
+    print(f"latency p99:    {stats['p99']:.2f} s")
+    for priority, p99 in stats['p99_by_priority'].items():
+        print(f"  {priority:<12}  {p99:.2f} s")
+    print(f"rejection rate: {stats['rejection_rate']:.1%}")
+    print(f"scheduler:      {scheduler.stats}, {scheduler.tokens_per_sec:.0f} tokens/sec measured")
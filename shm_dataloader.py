@@ -0,0 +1,554 @@
+import math
+import multiprocessing as mp
+import os
+import queue
+import sys
+import time
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+
+import torch
+from torch.utils.data import BatchSampler, RandomSampler, SequentialSampler
+
+# Hard cap on worker processes; the loader starts with one and adds more
+# only while the training loop is measurably waiting on data
+max_workers = max(1, min(4, (os.cpu_count() or 2) // 2))
+# Grow when the consumer spends more than this fraction of its time waiting
+wait_threshold = 0.05
+# Batches between auto-sizing decisions
+tune_interval = 16
+# Seconds between liveness checks while waiting on a worker
+poll_interval = 1.0
+_alignment = 64
+
+
+class WorkerError(RuntimeError):
+    """A loader worker raised while producing a batch, or exited unexpectedly."""
+
+
+def _layout(batch):
+    """Where each tensor of a collated batch goes inside a slot."""
+    layout = []
+    offset = 0
+    for key, value in batch.items():
+        if isinstance(value, torch.Tensor):
+            layout.append((key, value.dtype, tuple(value.shape), offset))
+            offset += math.ceil(value.numel() * value.element_size() / _alignment) * _alignment
+        else:
+            layout.append((key, None, value, None))
+    return layout, offset
+
+
+def _in_use(view):
+    # torch.frombuffer keeps a reference to the memoryview it wraps, so any
+    # tensor (or view of one) built on a slot shows up here; the three
+    # baseline references are the caller's, this argument and getrefcount's
+    return sys.getrefcount(view) > 3
+
+
+def _slot_view(buf, base, dtype, shape, offset):
+    count = math.prod(shape)
+    if count == 0:
+        return torch.empty(shape, dtype=dtype)
+    return torch.frombuffer(buf, dtype=dtype, count=count, offset=base + offset).view(shape)
+
+
+def _worker_loop(dataset, collate_fn, task_queue, done_queue, shm_name, slot_bytes):
+    # Workers only index and collate; leave the cores to the training threads
+    torch.set_num_threads(1)
+    shm = SharedMemory(name=shm_name)
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            batch_idx, slot, indices = task
+            start = time.perf_counter()
+            try:
+                batch = collate_fn([dataset[i] for i in indices])
+                layout, nbytes = _layout(batch)
+                if slot is None or nbytes > slot_bytes:
+                    # No free slot, or an oversized batch: pickle it through the queue
+                    layout = None
+                else:
+                    base = slot * slot_bytes
+                    for key, dtype, shape, offset in layout:
+                        if dtype is not None:
+                            _slot_view(shm.buf, base, dtype, shape, offset).copy_(batch[key])
+                    batch = None
+            except Exception:
+                # Report instead of dying, so the main process can raise it
+                done_queue.put((batch_idx, slot, None, None, time.perf_counter() - start, traceback.format_exc()))
+                continue
+            done_queue.put((batch_idx, slot, layout, batch, time.perf_counter() - start, None))
+    finally:
+        shm.close()
+
+
+class SharedMemoryDataLoader:
+    """
+    Prefetching data loader that hands batches over through shared memory.
+
+    Workers collate batches straight into slots of a shared-memory ring
+    buffer and only send the slot number and tensor layout back, so
+    batches are never pickled through a pipe; the main process wraps the
+    slot in tensors without copying. A slot is only recycled once no
+    tensor built on it (or view of one) is alive, so callers may hold
+    several batches at once, as the Trainer does for a gradient
+    accumulation window. While every slot is held, batches are pickled
+    through the queue instead; size num_slots to the number of batches
+    held at once to avoid that.
+
+    The loader starts with one worker and adds workers, up to
+    max_workers, while the consumer spends more than wait_threshold of
+    its time waiting. Prefetch depth follows the worker count.
+
+    An exception in the dataset or collate_fn is raised from iteration as
+    WorkerError with the worker's traceback; so is a worker that exits
+    without answering (e.g. killed for running out of memory), which
+    also stops the other workers.
+
+    Args:
+        dataset: Map-style dataset.
+        batch_size (int): Samples per batch.
+        collate_fn: Turns a list of samples into a dict of tensors.
+        sampler: Index sampler; defaults to random or sequential order.
+        shuffle (bool): Used when no sampler is given.
+        drop_last (bool): Drop the last incomplete batch.
+        max_workers (int): Upper bound on worker processes.
+        num_slots (int): Ring slots; defaults to two per worker.
+        slot_bytes (int): Bytes per ring slot; None sizes it from the
+            first batch with 50% headroom.
+    """
+
+    def __init__(self, dataset, batch_size, collate_fn, sampler=None, shuffle=False,
+                 drop_last=False, max_workers=max_workers, num_slots=None, slot_bytes=None):
+        if sampler is None:
+            sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+        self.dataset = dataset
+        self.collate_fn = collate_fn
+        self.batch_sampler = BatchSampler(sampler, batch_size, drop_last)
+        self.max_workers = max_workers
+        self.num_slots = num_slots or 2 * max_workers
+        self.slot_bytes = slot_bytes
+        self.num_workers = 0
+        self.prefetch_depth = 2
+        self.stats = {'wait_time': 0.0, 'consume_time': 0.0, 'batches': 0, 'produce_time': 0.0, 'pickled': 0}
+        # Slot -> memoryview for slots whose batch may still be referenced;
+        # kept across epochs since a caller can hold the last batch
+        self._held = {}
+        self._ctx = mp.get_context('fork' if 'fork' in mp.get_all_start_methods() else 'spawn')
+        self._shm = None
+        self._workers = []
+        self._task_queue = None
+        self._done_queue = None
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def _start(self, first_indices):
+        if self.slot_bytes is None:
+            sample = self.collate_fn([self.dataset[i] for i in first_indices])
+            self.slot_bytes = math.ceil(_layout(sample)[1] * 1.5 / _alignment) * _alignment or _alignment
+        self._shm = SharedMemory(create=True, size=self.slot_bytes * self.num_slots)
+        self._start_workers()
+
+    def _start_workers(self):
+        # Fresh queues, so nothing a stopped worker left behind is read
+        self._task_queue = self._ctx.Queue()
+        self._done_queue = self._ctx.Queue()
+        self._add_worker()
+
+    def _add_worker(self):
+        worker = self._ctx.Process(
+            target=_worker_loop,
+            args=(self.dataset, self.collate_fn, self._task_queue, self._done_queue,
+                  self._shm.name, self.slot_bytes),
+            daemon=True,
+        )
+        worker.start()
+        self._workers.append(worker)
+        self.num_workers = len(self._workers)
+        self.prefetch_depth = 2 * self.num_workers
+
+    def _autosize(self, window_wait, window_consume):
+        if self.num_workers >= self.max_workers:
+            return
+        if window_wait > wait_threshold * max(window_consume, 1e-9):
+            self._add_worker()
+
+    def _receive(self):
+        """Next message from the workers, raising WorkerError if one has died."""
+        while True:
+            try:
+                return self._done_queue.get(timeout=poll_interval)
+            except queue.Empty:
+                for worker in self._workers:
+                    if not worker.is_alive():
+                        raise WorkerError(f"Loader worker {worker.pid} exited unexpectedly "
+                                          f"(exit code {worker.exitcode})")
+
+    def _reclaim(self):
+        """Return held slots whose batches are no longer referenced."""
+        freed = []
+        for slot in list(self._held):
+            if not _in_use(self._held[slot]):
+                self._held.pop(slot).release()
+                freed.append(slot)
+        return freed
+
+    def __iter__(self):
+        batches = iter(self.batch_sampler)
+        first = next(batches, None)
+        if first is None:
+            return
+        if self._shm is None:
+            self._start(first)
+        elif not self._workers:
+            self._start_workers()
+
+        self._reclaim()
+        free_slots = [slot for slot in range(self.num_slots) if slot not in self._held]
+        queued = [first]
+        pending = {}
+        scheduled = received = next_batch = 0
+        returned_at = None
+        window_wait = window_consume = 0.0
+
+        def _schedule():
+            nonlocal scheduled
+            while scheduled - next_batch < self.prefetch_depth:
+                indices = queued.pop() if queued else next(batches, None)
+                if indices is None:
+                    return
+                slot = free_slots.pop() if free_slots else None
+                self._task_queue.put((scheduled, slot, list(indices)))
+                scheduled += 1
+
+        try:
+            _schedule()
+            while next_batch < scheduled:
+                now = time.perf_counter()
+                if returned_at is not None:
+                    window_consume += now - returned_at
+                reclaimed = self._reclaim()
+                if reclaimed:
+                    free_slots.extend(reclaimed)
+                    _schedule()
+
+                while next_batch not in pending:
+                    batch_idx, slot, layout, batch, produce_time, error = self._receive()
+                    received += 1
+                    pending[batch_idx] = (slot, layout, batch, error)
+                    self.stats['produce_time'] += produce_time
+                slot, layout, batch, error = pending.pop(next_batch)
+                if error is not None:
+                    if slot is not None:
+                        free_slots.append(slot)
+                    raise WorkerError(f"Loader worker failed on batch {next_batch}:\n{error}")
+                if layout is not None:
+                    base = slot * self.slot_bytes
+                    self._held[slot] = self._shm.buf[base:base + self.slot_bytes]
+                    batch = {
+                        key: _slot_view(self._held[slot], 0, dtype, shape, offset) if dtype is not None else shape
+                        for key, dtype, shape, offset in layout
+                    }
+                else:
+                    self.stats['pickled'] += 1
+                    if slot is not None:
+                        free_slots.append(slot)
+                next_batch += 1
+
+                returned_at = time.perf_counter()
+                window_wait += returned_at - now
+                self.stats['wait_time'] += returned_at - now
+                self.stats['batches'] += 1
+                if self.stats['batches'] % tune_interval == 0:
+                    self.stats['consume_time'] += window_consume
+                    self._autosize(window_wait, window_consume)
+                    window_wait = window_consume = 0.0
+                _schedule()
+                yield batch
+        finally:
+            # Also runs when the consumer stops early: wait for in-flight
+            # batches so no worker is still writing a slot the next epoch reuses
+            try:
+                while received < scheduled:
+                    self._receive()
+                    received += 1
+            except WorkerError:
+                # A dead worker's batches never arrive; stop the rest so none
+                # is still writing a slot, and start new ones next epoch
+                self._stop_workers()
+            free_slots.clear()
+            if returned_at is not None:
+                self.stats['consume_time'] += window_consume + time.perf_counter() - returned_at
+
+    def _stop_workers(self):
+        for _ in self._workers:
+            self._task_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        self.num_workers = 0
+
+    def close(self):
+        """Stop the workers and free the shared memory."""
+        self._stop_workers()
+        if self._shm is not None:
+            self._reclaim()
+            # Batches still referenced keep their own views of the mapping
+            self._held = {}
+            try:
+                self._shm.close()
+            except BufferError:
+                # A batch handed out earlier still views the buffer; the
+                # mapping goes away with it
+                pass
+            self._shm.unlink()
+            self._shm = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    @property
+    def worker_pids(self):
+        return [w.pid for w in self._workers]
+
+
+def use_shared_memory_loader(trainer, **kwargs):
+    """
+    Make a (SFT)Trainer build its training loader with SharedMemoryDataLoader.
+
+    Batches come back on the CPU; the Trainer moves them to the device in
+    _prepare_inputs as usual. The Trainer fetches a whole gradient
+    accumulation window before the first forward, so the ring gets a slot
+    per batch in the window on top of the prefetch slots.
+    """
+    kwargs.setdefault(
+        'num_slots', trainer.args.gradient_accumulation_steps + 2 * kwargs.get('max_workers', max_workers)
+    )
+
+    def get_train_dataloader():
+        dataset = trainer.train_dataset
+        if hasattr(trainer, '_remove_unused_columns'):
+            dataset = trainer._remove_unused_columns(dataset, description="training")
+        try:
+            sampler = trainer._get_train_sampler(dataset)
+        except TypeError:
+            sampler = trainer._get_train_sampler()
+        return SharedMemoryDataLoader(
+            dataset,
+            batch_size=trainer._train_batch_size,
+            collate_fn=trainer.data_collator,
+            sampler=sampler,
+            drop_last=trainer.args.dataloader_drop_last,
+            **kwargs,
+        )
+
+    trainer.get_train_dataloader = get_train_dataloader
+    return trainer
+
+
+def check_held_batches(held=8, batch_size=4):
+    """
+    Hold several batches at once, as the Trainer does, and check none was overwritten.
+
+    Batch i of a sequential loader over range(n) starts with batch_size * i;
+    a slot recycled too early would show a later batch's values instead.
+    """
+    class Numbers(torch.utils.data.Dataset):
+        def __len__(self):
+            return held * batch_size * 4
+
+        def __getitem__(self, i):
+            return torch.tensor([i])
+
+    def collate(samples):
+        return {'input_ids': torch.stack(samples)}
+
+    # Fewer slots than held batches, so the pickling fallback is exercised too
+    loader = SharedMemoryDataLoader(Numbers(), batch_size, collate, max_workers=1, num_slots=2)
+    it = None
+    try:
+        for _ in range(2):
+            it = iter(loader)
+            window = [next(it) for _ in range(held)]
+            firsts = [int(b['input_ids'][0]) for b in window]
+            expected = [batch_size * i for i in range(held)]
+            assert firsts == expected, f"held batches were overwritten: {firsts} != {expected}"
+            # Drop the window and read on; reclaimed slots must be reused safely
+            del window
+            rest = [int(b['input_ids'][0]) for b in it]
+            assert rest == [batch_size * i for i in range(held, len(loader))], rest
+    finally:
+        if it is not None:
+            it.close()
+        loader.close()
+    return loader.stats
+
+
+def check_worker_failures(batch_size=4, timeout=20.0):
+    """
+    Check that a raising dataset and a killed worker both surface as
+    WorkerError within timeout seconds instead of hanging, and that the
+    shared memory is still freed.
+    """
+    class Failing(torch.utils.data.Dataset):
+        def __init__(self, bad_index, kill):
+            self.bad_index, self.kill = bad_index, kill
+
+        def __len__(self):
+            return batch_size * 16
+
+        def __getitem__(self, i):
+            if i == self.bad_index:
+                if self.kill:
+                    # What the OOM killer leaves behind: no reply, no traceback
+                    os._exit(137)
+                raise ValueError(f"bad sample {i}")
+            return torch.tensor([i])
+
+    def collate(samples):
+        return {'input_ids': torch.stack(samples)}
+
+    for kill in (False, True):
+        loader = SharedMemoryDataLoader(Failing(batch_size * 5 + 1, kill), batch_size, collate, max_workers=1)
+        start = time.perf_counter()
+        try:
+            # Batches are dropped as they arrive, so close() can unmap the ring
+            sum(1 for _ in loader)
+            raise AssertionError("no error raised")
+        except WorkerError as e:
+            assert kill or 'bad sample' in str(e), str(e)
+        finally:
+            shm_name = loader._shm.name if loader._shm is not None else None
+            loader.close()
+        elapsed = time.perf_counter() - start
+        assert elapsed < timeout, f"took {elapsed:.1f}s to report the failure"
+        if shm_name is not None:
+            try:
+                SharedMemory(name=shm_name).close()
+                raise AssertionError(f"shared memory {shm_name} leaked")
+            except FileNotFoundError:
+                pass
+
+
+def _proc_status(pid):
+    """RSS (bytes) and context switches of a live process, from /proc."""
+    rss = switches = 0
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith(('voluntary_ctxt_switches:', 'nonvoluntary_ctxt_switches:')):
+                    switches += int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return rss, switches
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def measure_loader(loader, consume, epochs=1):
+    """
+    Drive a loader with a simulated training step and report its cost.
+
+    Args:
+        loader: Any iterable of batches.
+        consume: Callable run on each batch (the "training step").
+        epochs (int): Passes over the loader.
+
+    Returns:
+        dict: wait_time (s spent blocked on the loader), rss_mb (main +
+              workers, sampled at the end of the last epoch),
+              context_switches (main + workers) and batches.
+    """
+    pid = os.getpid()
+    _, switches_before = _proc_status(pid)
+    wait = 0.0
+    batches = 0
+    rss = switches = 0
+    for _ in range(epochs):
+        it = iter(loader)
+        while True:
+            start = time.perf_counter()
+            batch = next(it, None)
+            wait += time.perf_counter() - start
+            if batch is None:
+                break
+            consume(batch)
+            batches += 1
+            if batches % tune_interval == 0:
+                # Sample while workers are alive
+                rss, switches = 0, 0
+                for p in [pid] + _children(pid):
+                    r, s = _proc_status(p)
+                    rss += r
+                    switches += s
+    return {
+        'wait_time': wait,
+        'rss_mb': rss / 1024 / 1024,
+        'context_switches': switches - switches_before,
+        'batches': batches,
+    }
+
+
+if __name__ == "__main__":
+    from torch.utils.data import DataLoader
+
+    stats = check_held_batches()
+    print(f"[INFO] Held-batch check passed ({stats['pickled']} of {stats['batches']} batches pickled)")
+    check_worker_failures()
+    print("[INFO] Worker failure check passed")
+
+    # Synthetic packed-SFT batches: fixed-length token rows, like packing=True
+    context_length = 512
+    batch_size = 8
+    num_samples = 4096
+
+    class PackedDataset(torch.utils.data.Dataset):
+        def __len__(self):
+            return num_samples
+
+        def __getitem__(self, i):
+            ids = torch.randint(0, 32000, (context_length,))
+            return {'input_ids': ids, 'attention_mask': torch.ones_like(ids)}
+
+    def collate(samples):
+        input_ids = torch.stack([s['input_ids'] for s in samples])
+        return {
+            'input_ids': input_ids,
+            'attention_mask': torch.stack([s['attention_mask'] for s in samples]),
+            'labels': input_ids.clone(),
+        }
+
+    weight = torch.randn(context_length, context_length)
+
+    def train_step(batch):
+        (batch['input_ids'].float() @ weight).sum()
+
+    dataset = PackedDataset()
+    baseline = DataLoader(dataset, batch_size=batch_size, collate_fn=collate, num_workers=os.cpu_count())
+    shm_loader = SharedMemoryDataLoader(dataset, batch_size=batch_size, collate_fn=collate)
+
+    print(f"{'loader':>28} | {'wait (s)':>9} | {'RSS (MB)':>9} | {'ctx switches':>12}")
+    for label, loader in ((f"DataLoader(workers={os.cpu_count()})", baseline),
+                          ("SharedMemoryDataLoader", shm_loader)):
+        stats = measure_loader(loader, train_step)
+        print(f"{label:>28} | {stats['wait_time']:9.3f} | {stats['rss_mb']:9.1f} | {stats['context_switches']:12d}")
+    print(f"[INFO] SharedMemoryDataLoader settled on {shm_loader.num_workers} workers, "
+          f"prefetch depth {shm_loader.prefetch_depth}")
+    shm_loader.close()
@@ -0,0 +1,361 @@
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from timing_report import load_harmful_skew_columns, summarize
+
+# One sub-directory of .npy columns per run, plus runs.json with the
+# per-run summaries so trends over hundreds of runs never touch columns
+store_dir = 'timing_index'
+manifest_name = 'runs.json'
+# Slack / harmful-skew changes smaller than this (ns) are noise
+tolerance = 0.001
+
+_fnv_offset = np.uint64(0xcbf29ce484222325)
+_fnv_prime = np.uint64(0x100000001b3)
+
+
+def path_keys(paths, is_setup):
+    """
+    64-bit keys for (startpoint -> endpoint, violation type).
+
+    FNV-1a over the name bytes, computed one byte column at a time across
+    all rows; NUL padding from the fixed-width array is skipped so the key
+    doesn't depend on the array width. The lowest bit is the violation type.
+    """
+    width = paths.dtype.itemsize
+    data = np.ascontiguousarray(paths).view(np.uint8).reshape(-1, width)
+    keys = np.full(len(paths), _fnv_offset, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for i in range(width):
+            byte = data[:, i].astype(np.uint64)
+            keys = np.where(byte != 0, (keys ^ byte) * _fnv_prime, keys)
+    return (keys << np.uint64(1)) | is_setup.astype(np.uint64)
+
+
+def load_manifest(store=store_dir):
+    """Run summaries in ingestion order."""
+    path = os.path.join(store, manifest_name)
+    if not os.path.exists(path):
+        return {'runs': []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(manifest, store):
+    path = os.path.join(store, manifest_name)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def ingest(report_path, run_name, store=store_dir):
+    """
+    Parse a harmful_skew_report.txt once and add it to the index.
+
+    Records are de-duplicated per key (keeping the worst slack) and stored
+    sorted by key, so later lookups are binary searches over mmapped
+    columns. Path names go into one blob with an offsets column and are
+    only read back for the rows a diff reports.
+
+    Args:
+        report_path (str): Report written by hrm7.tcl.
+        run_name (str): Identifier for this run, e.g. "cts_iter_03".
+        store (str): Index directory.
+
+    Returns:
+        dict: The run's manifest entry.
+    """
+    columns = load_harmful_skew_columns(report_path, with_paths=True)
+    summary = summarize(columns)
+
+    keys = path_keys(columns['path'], columns['is_setup'])
+    # Worst slack first within each key, then keep the first of each key
+    order = np.lexsort((columns['slack'], keys))
+    keys = keys[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    order = order[first]
+
+    run_dir = os.path.join(store, run_name)
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    os.makedirs(run_dir)
+    np.save(os.path.join(run_dir, 'keys.npy'), keys[first])
+    for name in ('slack', 'skew', 'harmful'):
+        np.save(os.path.join(run_dir, f'{name}.npy'), columns[name][order].astype(np.float32))
+    np.save(os.path.join(run_dir, 'clock.npy'), columns['clock'][order].astype(np.int16))
+
+    names = columns['path'][order]
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(np.char.str_len(names), out=offsets[1:])
+    np.save(os.path.join(run_dir, 'name_offsets.npy'), offsets)
+    with open(os.path.join(run_dir, 'names.bin'), 'wb') as f:
+        f.write(b''.join(names.tolist()))
+
+    entry = {
+        'name': run_name,
+        'report': os.path.abspath(report_path),
+        'paths': int(len(order)),
+        'clock_names': columns['clock_names'],
+        'setup_tns': summary['setup']['tns'],
+        'hold_tns': summary['hold']['tns'],
+        'harmful_total': summary['harmful']['total'],
+        'harmful_paths': summary['harmful']['count'],
+    }
+    manifest = load_manifest(store)
+    manifest['runs'] = [r for r in manifest['runs'] if r['name'] != run_name] + [entry]
+    _save_manifest(manifest, store)
+    return entry
+
+
+def load_run(run_name, store=store_dir):
+    """Memory-map a run's columns."""
+    run_dir = os.path.join(store, run_name)
+    run = {
+        name: np.load(os.path.join(run_dir, f'{name}.npy'), mmap_mode='r')
+        for name in ('keys', 'slack', 'skew', 'harmful', 'clock', 'name_offsets')
+    }
+    run['dir'] = run_dir
+    return run
+
+
+def _names(run, indices):
+    offsets = run['name_offsets']
+    with open(os.path.join(run['dir'], 'names.bin'), 'rb') as f:
+        names = []
+        for i in indices:
+            f.seek(offsets[i])
+            names.append(f.read(offsets[i + 1] - offsets[i]).decode())
+    return names
+
+
+def _records(run, indices):
+    indices = np.asarray(indices)
+    kinds = np.where(np.asarray(run['keys'])[indices] & np.uint64(1), 'Setup', 'Hold')
+    return [
+        {'path': name, 'type': str(kind), 'slack': float(run['slack'][i]), 'harmful': float(run['harmful'][i])}
+        for name, kind, i in zip(_names(run, indices), kinds, indices)
+    ]
+
+
+def diff_runs(old_name, new_name, store=store_dir, top=20, tolerance=tolerance):
+    """
+    Compare two indexed runs by key lookup, without re-parsing either report.
+
+    Args:
+        old_name (str): Baseline run.
+        new_name (str): Run to compare against it.
+        store (str): Index directory.
+        top (int): Rows to list per category, worst first.
+        tolerance (float): Minimum change (ns) that counts as worsened.
+
+    Returns:
+        dict: Counts and top rows for "new", "fixed" and "worsened"
+              violations, plus TNS and harmful-skew deltas.
+    """
+    manifest = {r['name']: r for r in load_manifest(store)['runs']}
+    old, new = load_run(old_name, store), load_run(new_name, store)
+    old_keys, new_keys = np.asarray(old['keys']), np.asarray(new['keys'])
+
+    # Both key columns are sorted, so one searchsorted matches them up
+    pos = np.searchsorted(old_keys, new_keys)
+    in_old = np.zeros(len(new_keys), dtype=bool)
+    found = pos < len(old_keys)
+    in_old[found] = old_keys[pos[found]] == new_keys[found]
+    in_new = np.zeros(len(old_keys), dtype=bool)
+    in_new[pos[in_old]] = True
+
+    new_only = np.flatnonzero(~in_old)
+    fixed = np.flatnonzero(~in_new)
+    common_new = np.flatnonzero(in_old)
+    common_old = pos[in_old]
+
+    old_slack = np.asarray(old['slack'])[common_old]
+    new_slack = np.asarray(new['slack'])[common_new]
+    old_harmful = np.nan_to_num(np.asarray(old['harmful'])[common_old])
+    new_harmful = np.nan_to_num(np.asarray(new['harmful'])[common_new])
+    worse = (new_slack < old_slack - tolerance) | (new_harmful > old_harmful + tolerance)
+    worse_new, worse_old = common_new[worse], common_old[worse]
+    slack_delta = new_slack[worse] - old_slack[worse]
+
+    new_order = new_only[np.argsort(np.asarray(new['slack'])[new_only])][:top]
+    fixed_order = fixed[np.argsort(np.asarray(old['slack'])[fixed])][:top]
+    worse_order = np.argsort(slack_delta)[:top]
+
+    worsened = _records(new, worse_new[worse_order])
+    for record, i in zip(worsened, worse_old[worse_order]):
+        record['old_slack'] = float(old['slack'][i])
+        record['old_harmful'] = float(old['harmful'][i])
+
+    old_entry, new_entry = manifest[old_name], manifest[new_name]
+    return {
+        'old_run': old_name,
+        'new_run': new_name,
+        'new_count': int(len(new_only)),
+        'fixed_count': int(len(fixed)),
+        'worsened_count': int(worse.sum()),
+        'new': _records(new, new_order),
+        'fixed': _records(old, fixed_order),
+        'worsened': worsened,
+        'delta_setup_tns': new_entry['setup_tns'] - old_entry['setup_tns'],
+        'delta_hold_tns': new_entry['hold_tns'] - old_entry['hold_tns'],
+        'delta_harmful_total': new_entry['harmful_total'] - old_entry['harmful_total'],
+    }
+
+
+def format_diff(diff):
+    """Render diff_runs() output as a plain-text report."""
+    lines = [
+        f"Timing diff: {diff['old_run']} -> {diff['new_run']}",
+        "----------------------------------------",
+        f"Delta Setup TNS:       {diff['delta_setup_tns']:10.3f} ns",
+        f"Delta Hold TNS:        {diff['delta_hold_tns']:10.3f} ns",
+        f"Delta Harmful Skew:    {diff['delta_harmful_total']:10.3f} ns",
+        f"New violations:      {diff['new_count']}",
+        f"Fixed violations:    {diff['fixed_count']}",
+        f"Worsened violations: {diff['worsened_count']}",
+    ]
+    for title, key in (("New", 'new'), ("Fixed", 'fixed')):
+        if diff[key]:
+            lines += ["", f"{title} violations (worst first):"]
+            lines += [
+                f"{r['path']:<80} | {r['type']:<6} | {r['slack']:8.3f} | {r['harmful']:8.3f}"
+                for r in diff[key]
+            ]
+    if diff['worsened']:
+        lines += ["", "Worsened violations (largest slack loss first):"]
+        lines += [
+            f"{r['path']:<80} | {r['type']:<6} | {r['old_slack']:8.3f} -> {r['slack']:8.3f} | "
+            f"{r['old_harmful']:8.3f} -> {r['harmful']:8.3f}"
+            for r in diff['worsened']
+        ]
+    return "\n".join(lines)
+
+
+def format_history(store=store_dir):
+    """One line per indexed run, read from the manifest only."""
+    lines = [f"{'Run':<30} | {'Paths':>8} | {'Setup TNS':>10} | {'Hold TNS':>10} | {'Harmful':>10}"]
+    for r in load_manifest(store)['runs']:
+        lines.append(
+            f"{r['name']:<30} | {r['paths']:8d} | {r['setup_tns']:10.3f} | "
+            f"{r['hold_tns']:10.3f} | {r['harmful_total']:10.3f}"
+        )
+    return "\n".join(lines)
+
+
+def write_synthetic_report(path, rows):
+    """
+    Write rows as a harmful_skew_report.txt in hrm7.tcl's layout.
+
+    Args:
+        path (str): Output file.
+        rows (dict): Path name -> (type, skew, slack, harmful, clock), with
+            skew and harmful None for cross-clock paths.
+    """
+    details = []
+    with open(path, 'w') as f:
+        f.write("Harmful Skew Analysis Report - synthetic\n----------------------------------------\n")
+        f.write("Path | Skew (ns) | Slack (ns) | Violation Type | Harmful Skew (ns) | Clock\n")
+        for name, (kind, skew, slack, harmful, clock) in rows.items():
+            if skew is None:
+                f.write(f"Warning: Cross-clock path ({clock})\n")
+                f.write(f"{name:<80} | {'N/A':>8} | {slack:8.3f} | {kind:<6} | {'N/A':>8} | {clock}\n")
+                continue
+            line = f"{name:<80} | {skew:8.3f} | {slack:8.3f} | {kind:<6} | {harmful:8.3f} | {clock}\n"
+            f.write(line)
+            if harmful > 0:
+                details.append(line)
+        # The repeated harmful rows must not be counted twice
+        f.write("\n----------------------------------------\nDetailed Paths with Harmful Skew:\n")
+        f.write(f"{'Path':<80} | {'Skew':>8} | {'Slack':>8} | {'Type':<6} | {'Harmful':>8}\n")
+        f.writelines(details)
+
+
+def _synthetic_row(rng):
+    kind = rng.choice(('Setup', 'Hold'))
+    slack = round(-rng.uniform(0.01, 1.0), 3)
+    if rng.random() < 0.05:
+        return kind, None, slack, None, 'clk_a->clk_b'
+    skew = round(rng.uniform(-0.5, 0.5), 3)
+    harmful = -skew if kind == 'Setup' and skew < 0 else skew if kind == 'Hold' and skew > 0 else 0.0
+    return kind, skew, slack, harmful, rng.choice(('clk_a', 'clk_b', 'clk_c'))
+
+
+def check_diff(paths=2000, changed=50, seed=0):
+    """
+    Index two synthetic runs with known differences and check diff_runs().
+
+    The second run drops `changed` paths (fixed), adds as many (new),
+    loses 0.1 ns of slack on as many (worsened) and gains 0.05 ns on
+    another set (improved, which is not worsened). The counts and TNS
+    deltas must match what was written.
+    """
+    rng = random.Random(seed)
+    old = {f"u{i}/Q -> u{i + 1}/D": _synthetic_row(rng) for i in range(paths)}
+    names = list(old)
+    fixed, worsened, improved = (names[i * changed:(i + 1) * changed] for i in range(3))
+
+    new = {name: row for name, row in old.items() if name not in fixed}
+    for name in worsened:
+        kind, skew, slack, harmful, clock = new[name]
+        new[name] = (kind, skew, round(slack - 0.1, 3), harmful, clock)
+    for name in improved:
+        kind, skew, slack, harmful, clock = new[name]
+        new[name] = (kind, skew, round(slack + 0.05, 3), harmful, clock)
+    for i in range(changed):
+        new[f"n{i}/Q -> n{i + 1}/D"] = _synthetic_row(rng)
+
+    def _tns(rows, kind):
+        return sum(round(row[2], 3) for row in rows.values() if row[0] == kind)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = os.path.join(tmp, 'index')
+        for run_name, rows in (('old', old), ('new', new)):
+            report = os.path.join(tmp, f"{run_name}.txt")
+            write_synthetic_report(report, rows)
+            ingest(report, run_name, store)
+        diff = diff_runs('old', 'new', store)
+
+    assert diff['fixed_count'] == changed, diff['fixed_count']
+    assert diff['new_count'] == changed, diff['new_count']
+    assert diff['worsened_count'] == changed, diff['worsened_count']
+    for kind, key in (('Setup', 'delta_setup_tns'), ('Hold', 'delta_hold_tns')):
+        expected = _tns(new, kind) - _tns(old, kind)
+        assert abs(diff[key] - expected) < 1e-6, (key, diff[key], expected)
+    return diff
+
+
+if __name__ == "__main__":
+    # Usage:
+    #   python timing_index.py ingest harmful_skew_report.txt cts_iter_03
+    #   python timing_index.py diff cts_iter_02 cts_iter_03
+    #   python timing_index.py history
+    #   python timing_index.py check
+    command = sys.argv[1] if len(sys.argv) > 1 else 'history'
+    if command == 'ingest':
+        entry = ingest(sys.argv[2], sys.argv[3])
+        print(f"[INFO] Indexed {entry['paths']} paths as {entry['name']}")
+    elif command == 'diff':
+        runs = [r['name'] for r in load_manifest()['runs']]
+        if len(sys.argv) > 3:
+            old_name, new_name = sys.argv[2], sys.argv[3]
+        else:
+            # Default to the two most recent runs
+            old_name, new_name = runs[-2], runs[-1]
+        print(format_diff(diff_runs(old_name, new_name)))
+    elif command == 'history':
+        print(format_history())
+    elif command == 'check':
+        diff = check_diff()
+        print(f"[INFO] Synthetic diff matches: {diff['new_count']} new, {diff['fixed_count']} fixed, "
+              f"{diff['worsened_count']} worsened, setup TNS {diff['delta_setup_tns']:+.3f} ns, "
+              f"hold TNS {diff['delta_hold_tns']:+.3f} ns")
+    else:
+        print(f"Unknown command {command!r}; expected ingest, diff, history or check")
+        sys.exit(1)
@@ -0,0 +1,411 @@
+import mmap
+import os
+import re
+import sys
+import tempfile
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Bytes of report handed to the parser at a time; memory is bounded by
+# this plus the numeric columns (~30 bytes per path)
+chunk_size = 16 * 1024 * 1024
+percentiles = (50, 90, 99)
+
+_newline, _pipe, _space = ord('\n'), ord('|'), ord(' ')
+
+# hrm7.tcl repeats every harmful row under this heading; stop before it
+_details_marker = b'Detailed Paths with Harmful Skew'
+
+# Per-group fields, plus the design-wide summary lines
+#   Design  WNS: -0.12  TNS: -3.45  Number of Violating Paths: 52
+#   Design (Hold)  WNS: -0.05  TNS: -0.30  Number of Violating Paths: 8
+# which must not be filed under whichever group happened to come last
+_number = rb"(-?\d+(?:\.\d+)?)"
+_qor_pattern = re.compile(
+    rb"Timing Path Group '([^']+)'"
+    rb"|(Critical Path Slack|Total Negative Slack|No\. of Violating Paths"
+    rb"|Total Hold Violation|No\. of Hold Violations)\s*:\s*" + _number +
+    rb"|^[ \t]*Design[ \t]*(\(Hold\))?[ \t]+WNS:\s*" + _number + rb"\s+TNS:\s*" + _number +
+    rb"\s+Number of Violating Paths:\s*" + _number,
+    re.MULTILINE,
+)
+_qor_fields = {
+    b'Critical Path Slack': 'wns',
+    b'Total Negative Slack': 'tns',
+    b'No. of Violating Paths': 'violating_paths',
+    b'Total Hold Violation': 'hold_tns',
+    b'No. of Hold Violations': 'hold_violations',
+}
+
+
+def _iter_chunks(mm, end):
+    """Yield newline-aligned slices of the mapped file."""
+    start = 0
+    while start < end:
+        stop = min(start + chunk_size, end)
+        if stop < end:
+            newline = mm.find(b'\n', stop, end)
+            stop = end if newline == -1 else newline + 1
+        yield mm[start:stop]
+        start = stop
+
+
+def _fields(padded, starts, ends):
+    """Cut [starts, ends) byte ranges out of the buffer as a fixed-width bytes array."""
+    lengths = ends - starts
+    width = max(int(lengths.max()), 1) if lengths.size else 1
+    out = sliding_window_view(padded, width)[starts]
+    out[np.arange(width) >= lengths[:, None]] = _space
+    return np.char.strip(out.view(f'S{width}').ravel())
+
+
+def _to_float(field):
+    field[field == b'N/A'] = b'nan'
+    return field.astype(np.float64)
+
+
+def parse_chunk(chunk):
+    """
+    Parse one newline-aligned block of harmful_skew_report.txt rows.
+
+    Rows look like
+    "start -> end | skew | slack | Setup/Hold | harmful [| clock]"
+    with "N/A" for cross-clock skew, as written by hrm7.tcl. Line and
+    field boundaries are found with vectorized byte scans, so no Python
+    code runs per row. Headers and warnings are skipped.
+
+    Returns:
+        dict: "path" and "clock" (bytes arrays), "skew", "slack",
+              "harmful" (float64, NaN for N/A) and "is_setup" (bool).
+    """
+    n = len(chunk)
+    raw = np.frombuffer(chunk, dtype=np.uint8)
+    newlines = np.flatnonzero(raw == _newline)
+    line_starts = np.concatenate(([0], newlines + 1))
+    line_ends = np.concatenate((newlines, [n]))
+    pipes = np.flatnonzero(raw == _pipe)
+
+    first = np.searchsorted(pipes, line_starts)
+    count = np.searchsorted(pipes, line_ends) - first
+    keep = (count == 4) | (count == 5)
+    first, count, line_starts, line_ends = first[keep], count[keep], line_starts[keep], line_ends[keep]
+
+    # Pad so every field window stays inside the buffer
+    pad = int((line_ends - line_starts).max()) + 1 if keep.any() else 1
+    padded = np.concatenate((raw, np.full(pad, _space, dtype=np.uint8)))
+
+    bars = pipes[first[:, None] + np.arange(4)]
+    has_clock = count == 5
+    fifth = np.where(has_clock, pipes[np.minimum(first + 4, len(pipes) - 1)], line_ends)
+
+    kind = _fields(padded, bars[:, 2] + 1, bars[:, 3])
+    is_setup = kind == b'Setup'
+    # Drop the "Path | Skew (ns) | ..." header rows
+    rows = is_setup | (kind == b'Hold')
+    bars, has_clock, fifth, line_starts, line_ends = (
+        bars[rows], has_clock[rows], fifth[rows], line_starts[rows], line_ends[rows]
+    )
+
+    return {
+        'path': _fields(padded, line_starts, bars[:, 0]),
+        'skew': _to_float(_fields(padded, bars[:, 0] + 1, bars[:, 1])),
+        'slack': _to_float(_fields(padded, bars[:, 1] + 1, bars[:, 2])),
+        'is_setup': is_setup[rows],
+        'harmful': _to_float(_fields(padded, bars[:, 3] + 1, fifth)),
+        'clock': _fields(padded, np.where(has_clock, fifth + 1, line_ends), line_ends),
+    }
+
+
+def iter_report_chunks(path):
+    """
+    Stream a harmful_skew_report.txt through mmap, yielding parse_chunk() columns.
+
+    Parsing stops at the "Detailed Paths" section, which repeats rows.
+    """
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = mm.find(_details_marker)
+        if end == -1:
+            end = len(mm)
+        for chunk in _iter_chunks(mm, end):
+            columns = parse_chunk(chunk)
+            if columns['slack'].size:
+                yield columns
+
+
+def load_harmful_skew_columns(path, with_paths=False):
+    """
+    Stream-parse harmful_skew_report.txt rows into columnar arrays.
+
+    Args:
+        path (str): Report to parse.
+        with_paths (bool): Also return the "start -> end" names as a
+            bytes array under "path".
+
+    Returns:
+        dict: "skew", "slack", "harmful" (float64, NaN for N/A),
+              "is_setup" (bool), "clock" (int32 codes into "clock_names").
+    """
+    skew, slack, harmful, is_setup, clock, paths = [], [], [], [], [], []
+    clock_codes = {}
+
+    for columns in iter_report_chunks(path):
+        if with_paths:
+            paths.append(columns['path'])
+        skew.append(columns['skew'])
+        slack.append(columns['slack'])
+        harmful.append(columns['harmful'])
+        is_setup.append(columns['is_setup'])
+        names, inverse = np.unique(columns['clock'], return_inverse=True)
+        codes = np.array([clock_codes.setdefault(n.decode(), len(clock_codes)) for n in names], dtype=np.int32)
+        clock.append(codes[inverse])
+
+    def _join(parts, dtype):
+        return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+    result = {
+        'skew': _join(skew, np.float64),
+        'slack': _join(slack, np.float64),
+        'harmful': _join(harmful, np.float64),
+        'is_setup': _join(is_setup, bool),
+        'clock': _join(clock, np.int32),
+        'clock_names': list(clock_codes),
+    }
+    if with_paths:
+        result['path'] = _join(paths, 'S1')
+    return result
+
+
+def _harmful_stats(values):
+    if values.size == 0:
+        stats = {'count': 0, 'total': 0.0, 'max': 0.0, 'min': 0.0, 'avg': 0.0}
+        stats.update({f"p{p}": 0.0 for p in percentiles})
+        return stats
+    stats = {
+        'count': int(values.size),
+        'total': float(values.sum()),
+        'max': float(values.max()),
+        'min': float(values.min()),
+        'avg': float(values.mean()),
+    }
+    # np.percentile partitions rather than sorts; p50 matches hrm7.tcl's median
+    for p, v in zip(percentiles, np.percentile(values, percentiles)):
+        stats[f"p{p}"] = float(v)
+    return stats
+
+
+def summarize(columns):
+    """
+    Compute TNS, averages and harmful-skew statistics in one pass over the columns.
+
+    Harmful skew statistics only count paths with harmful skew > 0, as
+    hrm7.tcl does; they are reported overall and per clock domain.
+
+    Returns:
+        dict: "setup"/"hold"/"overall" slack stats, "harmful" overall stats
+              and "clocks" mapping clock name to harmful stats.
+    """
+    slack = columns['slack']
+    is_setup = columns['is_setup']
+    valid = ~np.isnan(slack)
+    setup_slack = slack[valid & is_setup]
+    hold_slack = slack[valid & ~is_setup]
+
+    def _slack_stats(values):
+        tns = float(values.sum())
+        return {
+            'count': int(values.size),
+            'tns': tns,
+            'avg': tns / values.size if values.size else 0.0,
+            'wns': float(values.min()) if values.size else 0.0,
+        }
+
+    harmful = columns['harmful']
+    mask = harmful > 0  # NaN compares False
+    values = harmful[mask]
+    codes = columns['clock'][mask]
+    # Group by clock domain with one stable sort on the integer codes
+    order = np.argsort(codes, kind='stable')
+    values = values[order]
+    codes = codes[order]
+    bounds = np.searchsorted(codes, np.arange(len(columns['clock_names']) + 1))
+
+    clocks = {}
+    for code, name in enumerate(columns['clock_names']):
+        domain = values[bounds[code]:bounds[code + 1]]
+        if domain.size:
+            clocks[name or 'unknown'] = _harmful_stats(domain)
+
+    return {
+        'setup': _slack_stats(setup_slack),
+        'hold': _slack_stats(hold_slack),
+        'overall': _slack_stats(slack[valid]),
+        'harmful': _harmful_stats(values),
+        'clocks': clocks,
+    }
+
+
+def parse_qor(path):
+    """
+    Pull per-path-group TNS and violation counts out of a report_qor dump.
+
+    Replaces the line-by-line regexp loop in ToatlTnsAvgTNS.tcl with one
+    regex scan over the mapped file.
+
+    Returns:
+        dict: "groups": path group name -> {"wns", "tns", "violating_paths",
+              "hold_tns", "hold_violations"}, with numbers outside any
+              group under ""; "design": "setup" and/or "hold" -> {"wns",
+              "tns", "violating_paths"} from the design summary lines.
+              Values missing from the report are absent.
+    """
+    groups = {}
+    design = {}
+    current = groups.setdefault('', {})
+    if os.path.getsize(path) == 0:
+        return {'groups': {}, 'design': {}}
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for match in _qor_pattern.finditer(mm):
+            group, field, value, hold, wns, tns, count = match.groups()
+            if group is not None:
+                current = groups.setdefault(group.decode(), {})
+            elif field is not None:
+                current[_qor_fields[field]] = float(value)
+            else:
+                design['hold' if hold else 'setup'] = {
+                    'wns': float(wns), 'tns': float(tns), 'violating_paths': float(count),
+                }
+    if not groups['']:
+        del groups['']
+    return {'groups': groups, 'design': design}
+
+
+def qor_totals(qor):
+    """
+    Design-wide TNS and average TNS per violating path, as ToatlTnsAvgTNS.tcl prints.
+
+    Uses the design summary lines when the report has them, otherwise
+    sums the path groups; hold totals are reported alongside.
+    """
+    groups = qor['groups'].values()
+    setup = qor['design'].get('setup')
+    hold = qor['design'].get('hold')
+    if setup is not None:
+        tns, num_paths = setup['tns'], int(setup['violating_paths'])
+    else:
+        tns = sum(g.get('tns', 0.0) for g in groups)
+        num_paths = int(sum(g.get('violating_paths', 0) for g in groups))
+    if hold is not None:
+        hold_tns, hold_violations = hold['tns'], int(hold['violating_paths'])
+    else:
+        hold_tns = sum(g.get('hold_tns', 0.0) for g in groups)
+        hold_violations = int(sum(g.get('hold_violations', 0) for g in groups))
+    return {
+        'tns': tns,
+        'violating_paths': num_paths,
+        'avg_tns': tns / num_paths if num_paths else 0.0,
+        'hold_tns': hold_tns,
+        'hold_violations': hold_violations,
+    }
+
+
+_two_group_qor = """\
+  Timing Path Group 'clk_a'
+  -----------------------------------
+  Critical Path Slack:           -0.12
+  Total Negative Slack:          -3.45
+  No. of Violating Paths:         42.00
+  Total Hold Violation:          -0.30
+  No. of Hold Violations:          8.00
+
+  Timing Path Group 'clk_b'
+  -----------------------------------
+  Critical Path Slack:           -0.05
+  Total Negative Slack:          -1.20
+  No. of Violating Paths:         10.00
+
+  Design  WNS: -0.12  TNS: -4.65  Number of Violating Paths: 52
+  Design (Hold)  WNS: -0.05  TNS: -0.30  Number of Violating Paths: 8
+"""
+
+
+def check_qor():
+    """
+    Parse a two-group report_qor dump and check the design summary lines
+    are kept out of the last group and used for the totals.
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.rpt') as f:
+        f.write(_two_group_qor)
+        f.flush()
+        qor = parse_qor(f.name)
+    assert qor['groups']['clk_b']['violating_paths'] == 10, qor['groups']['clk_b']
+    assert qor['groups']['clk_a']['violating_paths'] == 42, qor['groups']['clk_a']
+    totals = qor_totals(qor)
+    assert totals['violating_paths'] == 52 and totals['tns'] == -4.65, totals
+    assert totals['hold_violations'] == 8 and totals['hold_tns'] == -0.30, totals
+    return totals
+
+
+def format_summary(summary):
+    """Render the summary in the same layout as hrm7.tcl's statistics block."""
+    lines = [
+        "Timing Violation Statistics:",
+        "Total Negative Slack (TNS):",
+        f"  Setup: {summary['setup']['tns']:10.3f} ns",
+        f"  Hold:  {summary['hold']['tns']:10.3f} ns",
+        f"  Total: {summary['overall']['tns']:10.3f} ns",
+        "",
+        "Average Negative Slack:",
+        f"  Setup: {summary['setup']['avg']:10.3f} ns",
+        f"  Hold:  {summary['hold']['avg']:10.3f} ns",
+        f"  Overall: {summary['overall']['avg']:10.3f} ns",
+        "",
+        "Harmful Skew Statistics:",
+    ]
+    harmful = summary['harmful']
+    lines += [
+        f"Total Harmful Skew:    {harmful['total']:10.3f} ns",
+        f"Maximum Harmful Skew:  {harmful['max']:10.3f} ns",
+        f"Minimum Harmful Skew:  {harmful['min']:10.3f} ns",
+        f"Average Harmful Skew:  {harmful['avg']:10.3f} ns",
+        f"Median Harmful Skew:   {harmful['p50']:10.3f} ns",
+    ]
+    lines += [f"P{p} Harmful Skew:      {harmful[f'p{p}']:10.3f} ns" for p in percentiles if p != 50]
+    lines.append(f"Paths with Harmful Skew: {harmful['count']}")
+
+    if summary['clocks']:
+        lines += ["", "Harmful Skew by Clock Domain:"]
+        header = f"{'Clock':<30} | {'Paths':>8} | {'Total':>10} | {'Max':>8} | {'Avg':>8}"
+        header += "".join(f" | {'P' + str(p):>8}" for p in percentiles)
+        lines.append(header)
+        for name, stats in sorted(summary['clocks'].items()):
+            row = (f"{name:<30} | {stats['count']:8d} | {stats['total']:10.3f} | "
+                   f"{stats['max']:8.3f} | {stats['avg']:8.3f}")
+            row += "".join(f" | {stats[f'p{p}']:8.3f}" for p in percentiles)
+            lines.append(row)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Usage: python timing_report.py [harmful_skew_report.txt] [qor_report.rpt]
+    #        python timing_report.py check
+    if sys.argv[1:2] == ['check']:
+        totals = check_qor()
+        print(f"[INFO] QoR totals match the design summary: {totals['violating_paths']} violating paths, "
+              f"TNS {totals['tns']} ns")
+        sys.exit(0)
+    report_file = sys.argv[1] if len(sys.argv) > 1 else "harmful_skew_report.txt"
+    qor_file = sys.argv[2] if len(sys.argv) > 2 else None
+
+    print(format_summary(summarize(load_harmful_skew_columns(report_file))))
+
+    if qor_file:
+        totals = qor_totals(parse_qor(qor_file))
+        print(f"\nTotal Negative Slack (TNS): {totals['tns']} ns")
+        if totals['violating_paths'] > 0:
+            print(f"Average TNS: {totals['avg_tns']} ns/path")
+        else:
+            print("No violating paths found.")
+        print(f"Hold TNS: {totals['hold_tns']} ns over {totals['hold_violations']} violations")
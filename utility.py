@@ -1,13 +1,21 @@
 import argparse
+import os
 from transformers import AutoModelForCausalLM, AutoTokenizer, TextStreamer
 
+from model_store import model_path
+
 # Load the model and tokenizer for the pre-trained CodeLlama model
 model_name = "facebook/codellama-7b"  # Replace with your desired CodeLlama model
 
+# Serve the merged artifact written by export_merged.py when it exists
+merged_model_dir = "outputs/merged_model"
+if os.path.isdir(merged_model_dir):
+    model_name = merged_model_dir
+
 print("[INFO] Loading model...")
 # Load the pre-trained model and tokenizer
-model = AutoModelForCausalLM.from_pretrained(model_name, device_map="auto", torch_dtype="auto")
-tokenizer = AutoTokenizer.from_pretrained(model_name)
+model = AutoModelForCausalLM.from_pretrained(model_path(model_name), device_map="auto", torch_dtype="auto")
+tokenizer = AutoTokenizer.from_pretrained(model_path(model_name))
 
 print("[INFO] Model loaded and ready for inference.")
 
@@ -0,0 +1,583 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+import weakref
+from collections import deque
+from functools import lru_cache
+
+import numpy as np
+import torch
+from transformers import LogitsProcessor
+
+mask_cache_dir = 'outputs/verilog_masks'
+# Bump when the grammar below changes so cached masks are rebuilt
+grammar_version = 1
+# Deepest combined nesting of brackets and begin/case/... blocks allowed
+max_nesting = 10
+# States compiled up front (breadth-first from the start); the rest are
+# compiled the first time generation reaches them and added to the cache
+precompute_states = 64
+# Training modules walked during precompute, so the deeper states real
+# code reaches (nested always/case/generate blocks) are compiled too
+corpus_sample_size = 256
+
+# Grammar
+#
+# A byte-level state machine for one Verilog module:
+#   PRE   whitespace, comments and `directives until the "module" keyword
+#   BODY  the module, with (), [], {} and begin/end, case/endcase,
+#         function/endfunction, task/endtask, generate/endgenerate,
+#         fork/join tracked on a bounded stack; comments and strings
+#         are lexed so brackets and keywords inside them are ignored
+#   DONE  entered on "endmodule" with an empty stack; only EOS follows
+#
+# A state is (phase, lexer state, current keyword prefix, stack).
+
+PRE, BODY, DONE = 0, 1, 2
+
+_word_bytes = frozenset(b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$')
+_space_bytes = frozenset(b' \t\r\n')
+_printable = frozenset(range(0x20, 0x7f)) | _space_bytes
+_openers = {ord('('): '(', ord('['): '[', ord('{'): '{'}
+_closers = {ord(')'): '(', ord(']'): '[', ord('}'): '{'}
+_block_open = {
+    'begin': 'b', 'case': 'c', 'casez': 'c', 'casex': 'c', 'function': 'f',
+    'task': 't', 'generate': 'g', 'fork': 'k',
+}
+_block_close = {
+    'end': 'b', 'endcase': 'c', 'endfunction': 'f', 'endtask': 't',
+    'endgenerate': 'g', 'join': 'k', 'join_any': 'k', 'join_none': 'k',
+}
+_keywords = set(_block_open) | set(_block_close) | {'module', 'endmodule'}
+_keyword_prefixes = {k[:i] for k in _keywords for i in range(1, len(k) + 1)}
+
+start_state = (PRE, 'code', '', '')
+
+# Always walked during precompute, so a few levels of begin/case nesting
+# are compiled even without a corpus sample
+_reference_module = """module counter #(parameter WIDTH = 8) (
+    input clk,
+    input rst,
+    input [WIDTH-1:0] d,
+    output reg [WIDTH-1:0] q
+);
+    wire [WIDTH-1:0] next = {q[WIDTH-2:0], d[0]};
+    always @(posedge clk or posedge rst) begin
+        if (rst) begin
+            q <= 0;
+        end else begin
+            case (d[1:0])
+                2'b00: q <= next;
+                default: q <= q + 1'b1; // count
+            endcase
+        end
+    end
+    assign out = (a & b) | c;
+endmodule
+"""
+
+
+def _end_word(phase, word, stack):
+    if word in ('', '#'):
+        return phase, stack
+    if phase == PRE:
+        return (BODY, stack) if word == 'module' else None
+    if word == 'module':
+        return None
+    if word in _block_open:
+        return (phase, stack + _block_open[word]) if len(stack) < max_nesting else None
+    if word in _block_close:
+        return (phase, stack[:-1]) if stack and stack[-1] == _block_close[word] else None
+    # A keyword prefix such as "beg" used as an identifier
+    return phase, stack
+
+
+def _code_step(state, byte):
+    phase, _, word, stack = state
+    if byte in _word_bytes:
+        if word == '#':
+            return state
+        word += chr(byte)
+        if word == 'endmodule':
+            return (DONE, 'code', '', '') if not stack and phase == BODY else None
+        if word not in _keyword_prefixes:
+            if phase == PRE:
+                return None
+            word = '#'
+        return (phase, 'code', word, stack)
+
+    ended = _end_word(phase, word, stack)
+    if ended is None:
+        return None
+    phase, stack = ended
+    if byte in _space_bytes:
+        return (phase, 'code', '', stack)
+    if byte == ord('/'):
+        return (phase, 'slash', '', stack)
+    if phase == PRE:
+        return (phase, 'directive', '', stack) if byte == ord('`') else None
+    if byte in _openers:
+        return (phase, 'code', '', stack + _openers[byte]) if len(stack) < max_nesting else None
+    if byte in _closers:
+        return (phase, 'code', '', stack[:-1]) if stack and stack[-1] == _closers[byte] else None
+    if byte == ord('"'):
+        return (phase, 'str', '', stack)
+    return (phase, 'code', '', stack) if byte in _printable else None
+
+
+@lru_cache(maxsize=None)
+def _step(state, byte):
+    """Next state after one byte, or None if the byte is not allowed."""
+    phase, lex, word, stack = state
+    if phase == DONE:
+        return None
+    if lex == 'code':
+        return _code_step(state, byte)
+    if lex == 'slash':
+        if byte == ord('/'):
+            return (phase, 'line', '', stack)
+        if byte == ord('*'):
+            return (phase, 'block', '', stack)
+        # The slash was a division operator
+        return _code_step((phase, 'code', '', stack), byte) if phase == BODY else None
+    if lex == 'line':
+        return (phase, 'code', '', stack) if byte == ord('\n') else state
+    if lex == 'block':
+        return (phase, 'star', '', stack) if byte == ord('*') else state
+    if lex == 'star':
+        if byte == ord('/'):
+            return (phase, 'code', '', stack)
+        return state if byte == ord('*') else (phase, 'block', '', stack)
+    if lex == 'str':
+        if byte == ord('\\'):
+            return (phase, 'esc', '', stack)
+        if byte == ord('"'):
+            return (phase, 'code', '', stack)
+        return None if byte == ord('\n') else state
+    if lex == 'esc':
+        return (phase, 'str', '', stack)
+    if lex == 'directive':
+        if byte == ord('\n'):
+            return (phase, 'code', '', stack)
+        return state if byte in _printable else None
+    raise ValueError(f"Unknown lexer state {lex!r}")
+
+
+def _bytes_to_unicode():
+    # The printable-character alias byte-level BPE vocabularies use for each byte
+    bs = list(range(ord('!'), ord('~') + 1)) + list(range(ord('¡'), ord('¬') + 1)) + list(range(ord('®'), ord('ÿ') + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+
+def token_bytes(tokenizer):
+    """
+    The raw bytes each token id contributes to the decoded text.
+
+    Handles byte-level BPE (GPT-2 / Qwen / Llama 3 style) and sentencepiece
+    vocabularies with byte fallback (CodeLlama). Special tokens map to None.
+    """
+    pieces = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+    special = set(tokenizer.all_special_ids)
+    byte_level = any(p is not None and p.startswith('Ġ') for p in pieces)
+    decoder = {c: b for b, c in _bytes_to_unicode().items()}
+
+    result = []
+    for i, piece in enumerate(pieces):
+        if piece is None or i in special:
+            result.append(None)
+            continue
+        if byte_level:
+            if all(c in decoder for c in piece):
+                data = bytes(decoder[c] for c in piece)
+            else:
+                # Added tokens are stored as plain text
+                data = piece.encode()
+        else:
+            match = re.fullmatch(r'<0x([0-9A-Fa-f]{2})>', piece)
+            data = bytes([int(match.group(1), 16)]) if match else piece.replace('▁', ' ').encode()
+        result.append(data or None)
+    return result
+
+
+def tokenizer_key(tokenizer):
+    """Cache key for a tokenizer's masks: vocabulary, EOS and grammar version."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode())
+    digest.update(f"{tokenizer.eos_token_id}|{grammar_version}|{max_nesting}".encode())
+    return digest.hexdigest()[:16]
+
+
+class TokenMasks:
+    """
+    Per-state next-state tables over a tokenizer's vocabulary.
+
+    For every grammar state reached, one int32 array maps each token id to
+    the state after its bytes, or -1 if the token is not allowed there, so
+    the allowed-token mask is just ``table >= 0``. Tables are computed by
+    walking a byte trie of the vocabulary, so tokens sharing a prefix share
+    the work and a rejected prefix prunes its whole subtree.
+
+    Args:
+        tokenizer: The generating model's tokenizer.
+        cache_dir (str): Where tables are stored, one file per tokenizer.
+    """
+
+    def __init__(self, tokenizer, cache_dir=mask_cache_dir):
+        self.tokenizer = tokenizer
+        self.vocab_size = len(tokenizer)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.path = os.path.join(cache_dir, f"{tokenizer_key(tokenizer)}.npz")
+        self.states = []
+        self._ids = {}
+        self._tables = {}
+        self._trie = None
+        self._device_masks = {}
+        self._dirty = False
+        # Tables compiled by this instance rather than loaded from the cache
+        self.compiled = 0
+        if os.path.exists(self.path):
+            self._load()
+        self.start = self.intern(start_state)
+
+    def _load(self):
+        with np.load(self.path) as data:
+            for state in json.loads(str(data['states'])):
+                self.intern(tuple(state))
+            for name in data.files:
+                if name.startswith('next_'):
+                    self._tables[int(name[5:])] = data[name]
+
+    def save(self):
+        """Write all computed tables to the cache if anything is new."""
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        arrays = {f'next_{i}': table for i, table in self._tables.items()}
+        with open(f"{self.path}.tmp", 'wb') as f:
+            np.savez(f, states=np.array(json.dumps(self.states)), **arrays)
+        os.replace(f"{self.path}.tmp", self.path)
+        self._dirty = False
+
+    def intern(self, state):
+        state_id = self._ids.get(state)
+        if state_id is None:
+            state_id = self._ids[state] = len(self.states)
+            self.states.append(state)
+        return state_id
+
+    def _build_trie(self):
+        # node = [children by byte, token ids ending here]
+        root = [{}, []]
+        for token_id, data in enumerate(token_bytes(self.tokenizer)):
+            if data is None:
+                continue
+            node = root
+            for byte in data:
+                node = node[0].setdefault(byte, [{}, []])
+            node[1].append(token_id)
+        return root
+
+    def table(self, state_id):
+        """Next-state array for a state, computing it on first use."""
+        table = self._tables.get(state_id)
+        if table is not None:
+            return table
+        if self._trie is None:
+            self._trie = self._build_trie()
+
+        table = np.full(self.vocab_size, -1, dtype=np.int32)
+        pending = [(self._trie, self.states[state_id])]
+        while pending:
+            (children, ids), state = pending.pop()
+            if ids:
+                table[ids] = self.intern(state)
+            for byte, child in children.items():
+                next_state = _step(state, byte)
+                if next_state is not None:
+                    pending.append((child, next_state))
+        if self.states[state_id][0] == DONE and self.eos_token_id is not None:
+            table[self.eos_token_id] = state_id
+        self._tables[state_id] = table
+        self._dirty = True
+        self.compiled += 1
+        return table
+
+    def walk(self, text):
+        """Compile the tables along text's tokens, up to the first one the grammar rejects."""
+        state = self.start
+        for token_id in self.tokenizer(text, add_special_tokens=False)['input_ids']:
+            state = self.advance(state, token_id)
+            if state < 0:
+                return
+
+    def precompute(self, limit=precompute_states, corpus=()):
+        """
+        Compile tables breadth-first from the start state, then along the
+        reference module and each text in corpus, and save.
+
+        Args:
+            limit (int): Tables compiled breadth-first.
+            corpus (iterable of str): Module sources, e.g. corpus_sample(dataset).
+        """
+        queue, seen = deque([self.start]), {self.start}
+        for _ in range(limit):
+            if not queue:
+                break
+            table = self.table(queue.popleft())
+            for state_id in np.unique(table[table >= 0]).tolist():
+                if state_id not in seen:
+                    seen.add(state_id)
+                    queue.append(state_id)
+        self.walk(_reference_module)
+        for text in corpus:
+            self.walk(text)
+        self.save()
+
+    def advance(self, state_id, token_id):
+        """State after a token, or -1 if the grammar does not allow it."""
+        if token_id >= self.vocab_size:
+            return -1
+        return int(self.table(state_id)[token_id])
+
+    def state_after(self, text):
+        """
+        State after some Verilog text already in the prompt.
+
+        Raises:
+            ValueError: The text is not a valid module prefix.
+        """
+        state = start_state
+        for byte in text.encode():
+            state = _step(state, byte)
+            if state is None:
+                raise ValueError(f"Prompt prefix is not valid Verilog: {text!r}")
+        return self.intern(state)
+
+    def mask(self, state_ids, width, device):
+        """Boolean (batch, width) tensor of allowed tokens for each state."""
+        rows = []
+        for state_id in state_ids:
+            key = (state_id, width, device)
+            row = self._device_masks.get(key)
+            if row is None:
+                allowed = np.zeros(width, dtype=bool)
+                n = min(width, self.vocab_size)
+                allowed[:n] = self.table(state_id)[:n] >= 0
+                row = self._device_masks[key] = torch.from_numpy(allowed).to(device)
+            rows.append(row)
+        return rows[0].unsqueeze(0) if len(rows) == 1 else torch.stack(rows)
+
+
+def corpus_sample(dataset, size=corpus_sample_size, field='code', seed=0):
+    """Random module sources from a dataset (e.g. PyraNet's "code" column) for precompute."""
+    size = min(size, len(dataset))
+    return list(dataset.shuffle(seed=seed).select(range(size))[field])
+
+
+_loaded = weakref.WeakKeyDictionary()
+
+
+def load_masks(tokenizer, cache_dir=mask_cache_dir, corpus=()):
+    """
+    TokenMasks for a tokenizer, compiling and caching the common states.
+
+    Repeated calls with the same tokenizer return the same instance, so
+    states compiled during one generation are reused by the next. A
+    corpus sample is walked on the first call even when the cache is
+    already populated; with the tables cached this is only lookups.
+
+    Args:
+        tokenizer: The generating model's tokenizer.
+        cache_dir (str): Where tables are stored.
+        corpus (iterable of str): Module sources to precompute along,
+            e.g. corpus_sample(dataset).
+    """
+    masks = _loaded.get(tokenizer)
+    if masks is not None:
+        return masks
+    masks = _loaded[tokenizer] = TokenMasks(tokenizer, cache_dir)
+    if len(masks._tables) < precompute_states or corpus:
+        start = time.perf_counter()
+        masks.precompute(corpus=corpus)
+        print(f"[INFO] Compiled {masks.compiled} Verilog token masks in {time.perf_counter() - start:.1f}s "
+              f"({len(masks._tables)} cached) -> {masks.path}")
+    return masks
+
+
+class VerilogConstraint(LogitsProcessor):
+    """
+    Restrict generation to one well-formed Verilog module.
+
+    Each step advances every sequence's grammar state by the token it just
+    produced and applies all the states' allowed-token masks with one
+    masked_fill. After the top-level module's "endmodule" only EOS is
+    allowed, so generation stops there instead of running on to
+    max_new_tokens.
+
+    Args:
+        masks (TokenMasks): Tables for the model's tokenizer.
+        prefix (str): Verilog already in the prompt that the model continues,
+            e.g. a module header.
+
+    Example:
+        masks = load_masks(tokenizer)
+        outputs = model.generate(**inputs, logits_processor=[VerilogConstraint(masks)])
+    """
+
+    def __init__(self, masks, prefix=''):
+        self.masks = masks
+        self.start = masks.state_after(prefix)
+        self.states = None
+        self.elapsed = 0.0
+        self.steps = 0
+        # Steps that had to compile a table for a state not yet cached
+        self.cold_elapsed = 0.0
+        self.cold_steps = 0
+
+    def __call__(self, input_ids, scores):
+        start = time.perf_counter()
+        compiled = self.masks.compiled
+        if self.states is None:
+            self.states = [self.start] * input_ids.shape[0]
+        else:
+            for i, token_id in enumerate(input_ids[:, -1].tolist()):
+                next_state = self.masks.advance(self.states[i], token_id)
+                # Finished sequences are padded; keep their last state
+                if next_state >= 0:
+                    self.states[i] = next_state
+        allowed = self.masks.mask(self.states, scores.shape[-1], scores.device)
+        scores = scores.masked_fill(~allowed, float('-inf'))
+        elapsed = time.perf_counter() - start
+        self.elapsed += elapsed
+        self.steps += 1
+        if self.masks.compiled != compiled:
+            self.cold_elapsed += elapsed
+            self.cold_steps += 1
+        return scores
+
+
+def module_end(masks, token_ids, prefix=''):
+    """
+    Where the top-level module closes in a generated token sequence.
+
+    Returns:
+        int or None: Tokens up to and including the one that completes
+                     "endmodule", or None if the output never forms a
+                     complete, well-nested module.
+    """
+    state = masks.state_after(prefix)
+    for i, token_id in enumerate(token_ids):
+        state = masks.advance(state, token_id)
+        if state < 0:
+            return None
+        if masks.states[state][0] == DONE:
+            return i + 1
+    return None
+
+
+def evaluate(model, tokenizer, prompts, prefixes=None, max_new_tokens=256, max_attempts=3, **generate_kwargs):
+    """
+    Compare unconstrained and constrained generation on a prompt set.
+
+    Each prompt is regenerated until it yields a complete module, up to
+    max_attempts. Wasted tokens are those of failed attempts plus any
+    generated after the module closed.
+
+    Returns:
+        dict: Per mode ("unconstrained", "constrained"): tokens generated,
+              wasted tokens, mean attempts, success rate and seconds per
+              token; for the constrained mode also the mask overhead per
+              token, split into warm steps (all states cached) and cold
+              steps (a state's table compiled on the spot), and the
+              fraction of steps that were cold.
+    """
+    masks = load_masks(tokenizer)
+    prefixes = prefixes or [''] * len(prompts)
+    eos = tokenizer.eos_token_id
+    report = {}
+    for mode in ('unconstrained', 'constrained'):
+        tokens = wasted = attempts = successes = 0
+        mask_time = mask_steps = cold_time = cold_steps = 0
+        start = time.perf_counter()
+        for prompt, prefix in zip(prompts, prefixes):
+            inputs = tokenizer(prompt, return_tensors='pt').to(model.device)
+            for attempt in range(1, max_attempts + 1):
+                processors = []
+                if mode == 'constrained':
+                    processors = [VerilogConstraint(masks, prefix)]
+                with torch.no_grad():
+                    outputs = model.generate(
+                        **inputs, max_new_tokens=max_new_tokens, logits_processor=processors,
+                        pad_token_id=eos, **generate_kwargs,
+                    )
+                new = outputs[0, inputs['input_ids'].shape[1]:].tolist()
+                if eos in new:
+                    new = new[:new.index(eos)]
+                tokens += len(new)
+                if processors:
+                    mask_time += processors[0].elapsed
+                    mask_steps += processors[0].steps
+                    cold_time += processors[0].cold_elapsed
+                    cold_steps += processors[0].cold_steps
+                end = module_end(masks, new, prefix)
+                if end is not None:
+                    wasted += len(new) - end
+                    successes += 1
+                    break
+                wasted += len(new)
+            attempts += attempt
+        elapsed = time.perf_counter() - start
+        report[mode] = {
+            'tokens': tokens,
+            'wasted_tokens': wasted,
+            'mean_attempts': attempts / len(prompts),
+            'success_rate': successes / len(prompts),
+            'seconds_per_token': elapsed / max(tokens, 1),
+        }
+        if mode == 'constrained':
+            report[mode]['mask_seconds_per_token'] = (mask_time - cold_time) / max(mask_steps - cold_steps, 1)
+            report[mode]['cold_mask_seconds_per_token'] = cold_time / max(cold_steps, 1)
+            report[mode]['cold_token_fraction'] = cold_steps / max(mask_steps, 1)
+    masks.save()
+    return report
+
+
+if __name__ == "__main__":
+    # Usage: python verilog_constraint.py [model_path]
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    from model_store import load_local_dataset, model_path
+
+    model_name = model_path(sys.argv[1] if len(sys.argv) > 1 else "./codellama-pyranet-finetuned")
+    model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype="auto", device_map="auto")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    load_masks(tokenizer, corpus=corpus_sample(load_local_dataset("bnadimi/PyraNet-Verilog", split="train")))
+
+    headers = [
+        "module example (input a, input b, output c);",
+        "module counter (input clk, input rst, output reg [7:0] q);",
+        "module mux2 (input [3:0] a, input [3:0] b, input sel, output [3:0] y);",
+        "module adder (input [7:0] a, input [7:0] b, output [8:0] sum);",
+    ]
+    report = evaluate(model, tokenizer, headers, prefixes=headers, do_sample=True, temperature=0.7, top_p=0.95)
+    for mode, stats in report.items():
+        print(f"{mode}:")
+        print(f"  tokens generated: {stats['tokens']}")
+        print(f"  wasted tokens:    {stats['wasted_tokens']}")
+        print(f"  mean attempts:    {stats['mean_attempts']:.2f}")
+        print(f"  success rate:     {stats['success_rate']:.0%}")
+        print(f"  time per token:   {stats['seconds_per_token'] * 1e3:.2f} ms")
+    constrained = report['constrained']
+    print(f"mask overhead:      {constrained['mask_seconds_per_token'] * 1e6:.1f} us/token (cached states)")
+    print(f"cold overhead:      {constrained['cold_mask_seconds_per_token'] * 1e3:.1f} ms/token "
+          f"on {constrained['cold_token_fraction']:.1%} of tokens (state compiled on first use)")